@@ -3,178 +3,199 @@ import numpy as np
 import statistics as stat
 import random
 import re
-from LoT import else_, streak_, conform_, get_, patternCont_, balance_
+import json
+from joblib import Parallel, delayed
+from Results import loadResults, saveResults, ruleTables
 
-# get the data from the 
-bestRules = pd.read_csv("../Data/BestRules2B.csv", dtype={"sequence": str, "p_pred": str, "m_pred": str})
+def bmaPredict(data, holdout):
+    """
+    Predict every row with Bayesian model averaging over the correct rules of all rows with the same sequence and generator, but in a
+    different holdout group (the participant for LOOCV, or the fold for k-fold). Instead of filtering the training data for every row, the
+    posterior weights and posterior weighted predictions are summed once per (sequence, generator), after which the contribution of the
+    holdout group of the row itself is subtracted.
+    """
+    # the posterior weight and weighted prediction of each row, where rules that were not correct on the row do not count
+    w = data['posterior'].where(data['correct'].astype(bool), 0)
+    wm = w * data['m_pred'].astype(int)
+
+    # the totals of all rows minus those of the own group of each row, computed for all rows at once
+    key = [data['seq_id'], data['generator']]
+    W = w.groupby(key).transform('sum') - w.groupby([holdout] + key).transform('sum')
+    WM = wm.groupby(key).transform('sum') - wm.groupby([holdout] + key).transform('sum')
 
-def kfoldCV(data):
+    # predict a 1 if the weighted average is at least 0.5, rows without any relevant rules get a 0
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return ((W > 0) & (WM / W >= 0.5)).to_numpy().astype(np.uint8)
 
-    # define a k, for k-fold cross validation
-    k = 6
+def kfoldCV(data, k=6, seed=7331, verbose=True):
 
     # get the unique participants
     ids = data['p_id'].unique()
 
-    # set seed for reproducability
-    random.seed(7331)
-
-    # shuffle them
-    random.shuffle(ids)
+    # shuffle them, with a seed for reproducability
+    random.Random(seed).shuffle(ids)
 
     # shuffle the dataframe itself, but keep the participant data grouped
     data = data.set_index('p_id').loc[ids].reset_index()
 
-    # add the fold indicators to the dataframe
-    data['fold'] = np.repeat(range(k), data.shape[0]/k)
-
-    means = []
-    
-    # store the predictions with participant id and sequence as identfiers for convient merge with original dataframe
-    predictions = pd.DataFrame({'p_id' : [], 'sequence' : [], 'BayFold_pred' : []})
-
-    # loop k amount of times
-    for kfold in range(k):
-
-        # get the training data
-        train = data[data['fold'] != kfold]
-
-        # get the test data, which has k as fold
-        test = data[data['fold'] == kfold]
+    # add the fold indicators to the dataframe, the same as repeating every fold indicator data.shape[0] / k times, but the last rows
+    # also get a fold when the rows can not be divided over the folds evenly
+    data['fold'] = np.arange(data.shape[0]) * k // data.shape[0]
 
-        # create a new column called for the infered predictions
-        Inf_pred = []
+    # predict the rows of every fold with all the other folds
+    data['inf_pred'] = bmaPredict(data, data['fold'])
 
-        # go over all the data in the test data
-        for i in range(test.shape[0]):
+    # compute the mean accuracy for each fold
+    means = (data['p_pred'] == data['inf_pred']).groupby(data['fold']).mean().tolist()
 
-            # get the sequence, and define it as x for the evaluation rules for the current sequence
-            x = test.iloc[i]['sequence']
+    if verbose:
+        for kfold in range(k):
+            print("K fold: ", kfold, "Mean:", means[kfold])
+        print("Mean accuracy of k-fold:", stat.mean(means))
 
-            # get the current rules, adding the generator filter gives a higher accuracy for experiment 2B, but lower for experiment 1B
-            relRules = train[(train['sequence'] == x) & (train['correct']) & (train['generator'] == test.iloc[i]['generator'])] # & (train['generator'] == test.iloc[i]['generator'])
-
-            # enter the prediction as the mean prediction of all relevant rules for the current sequence three 1's, and two 0's would yield '1'
-            # This method results in a higher accuracy for 2B than Bayesian model Averaging, but not for 1B
-            #Inf_pred.append('1' if stat.mean(relRules['m_pred'].astype(int)) >= 0.5 else '0')
-
-            # use Bayesian model averaging to get a prediction for the current sequence
-            Inf_pred.append('1' if sum((relRules['posterior'] / sum(relRules['posterior']) * relRules['m_pred'].astype(int))) >= 0.5 else '0')
-
-        print("K fold: ", kfold)
-
-        # add the predictions to the test dataframe
-        test.insert(8,"inf_pred", Inf_pred)
-
-        # compute the mean accuracy for this k-fold
-        means.append(stat.mean(test['p_pred'] == test['inf_pred']))
+    # store the predictions with participant id and sequence as identfiers for convient merge with original dataframe
+    predictions = pd.DataFrame({'p_id' : data['p_id'], 'seq_id' : data['seq_id'], 'BayFold_pred' : data['inf_pred']})
 
-        # concat the predictions
-        predictions = pd.concat([predictions, pd.DataFrame({'p_id' : test['p_id'], 'sequence' : test['sequence'], 'BayFold_pred' : Inf_pred})])
+    return stat.mean(means), predictions
 
-        # print the mean
-        print("Mean:", means[kfold])
+def repeatedKfoldCV(data, seeds, k=6, n_jobs=-1):
+    """
+    Repeat k-fold cross validation for every seed, each shuffling the participants differently, in parallel. Returns the mean accuracy 
+    of every repetition and a 95% confidence interval of the accuracy.
+    """
+    output = Parallel(n_jobs=n_jobs)(delayed(kfoldCV)(data, k, seed, False) for seed in seeds)
+    means = np.array([mean for mean, _ in output])
+    ci = np.percentile(means, [2.5, 97.5])
 
-    print("Mean accuracy of k-fold:", stat.mean(means))
-    return stat.mean(means), predictions
+    print("Mean accuracy of repeated k-fold:", means.mean(), "95% CI:", ci)
+    return means, ci
 
 def leaveOneOutCV(data):
     """
     This function applied Leave One Out Cross Validation (LOOCV), which is similar to k-fold but with k = n - 1, as each participant is left out
     once.
     """
-    
-    # initialize some lists to track mean and predictions
-    means = []
-    all_predictions = []
-
-    # loop k amount of times
-    for par in data['p_id'].unique():
-
-        # create a new column called for the infered predictions
-        Inf_pred = []
+    # order the data by participant, so the predictions line up with the data of each participant in turn
+    data = data.iloc[np.argsort(pd.factorize(data['p_id'])[0], kind='stable')]
 
-        # get the test data, which is the current participant
-        test = data[data['p_id'] == par]
+    # predict the rows of every participant with all other participants
+    all_predictions = bmaPredict(data, data['p_id'])
 
-        # get the train data, which is every other participant than the current one
-        train = data[data['p_id'] != par]
+    # compute the mean accuracy of each participant
+    means = (data['p_pred'] == all_predictions).groupby(data['p_id'], sort=False).mean()
 
-        # go over all the train data
-        for i in range(test.shape[0]):
-
-            # get the sequence, and define it as x for the evaluation rules for the current sequence
-            x = test.iloc[i]['sequence']
+    print(len(all_predictions))
+    print("Mean accuracy of LOOCV:", stat.mean(means))
+    return stat.mean(means), list(all_predictions)
 
-            # get the current rules, adding the generator filter gives a higher accuracy for experiment 2B, but lower for experiment 1B
-            relRules = train[(train['sequence'] == x) & (train['correct']) & (train['generator'] == test.iloc[i]['generator'])] # & (train['generator'] == test.iloc[i]['generator'])
+def crossValidate(bestRules, k=6, seed=7331, repeats=100):
+    """
+    Perform both cross-validation methods on the best rules, and a repeated k-fold for a confidence interval of its accuracy. Returns the 
+    best rules with the predictions of the k-fold (BayFold_pred) and LOOCV (BayLOOCV_pred) added, and a summary with the mean accuracy of
+    both methods, and the mean accuracy of every repeated k-fold with their 95% confidence interval (empty without repeats).
+    """
+    kfCV_mean, kfoldpredictions = kfoldCV(bestRules, k, seed)
+    LOOCV_mean, LOOCVpredictions = leaveOneOutCV(bestRules)
 
-            # use Bayesian model averaging to get a prediction for the current sequence
-            Inf_pred.append('1' if sum((relRules['posterior'] / sum(relRules['posterior']) * relRules['m_pred'].astype(int))) >= 0.5 else '0')
+    # repeat the k-fold with differently shuffled participants, to get a confidence interval of its accuracy
+    summary = {'kfold_mean' : float(kfCV_mean), 'loocv_mean' : float(LOOCV_mean), 'k' : k, 'seed' : seed, 'repeated_means' : [],
+               'repeated_ci' : []}
+    if repeats:
+        kfCV_means, kfCV_ci = repeatedKfoldCV(bestRules, range(repeats), k)
+        summary.update(repeated_means=kfCV_means.tolist(), repeated_ci=kfCV_ci.tolist())
 
-        # add the predictions on the current participants data, into the test dataframe
-        test.insert(8,"inf_pred", Inf_pred)
+    # store the results of both validation methods
+    bestRules = pd.merge(bestRules, kfoldpredictions, on=['p_id', 'seq_id'], how='inner')
+    bestRules['BayLOOCV_pred'] = LOOCVpredictions
 
-        # store the predictions
-        all_predictions = all_predictions + Inf_pred
+    return bestRules, summary
 
-        # compute the mean accuracy
-        curMean = stat.mean(test['p_pred'] == test['inf_pred'])
+def updateCrossValidation(CVResults, bestRules, affected, k=6, seed=7331):
+    """
+    Update stored cross validation results (CVResults) after the best rules of the affected participants changed (see 
+    BestRule.updateBestRules). The LOOCV prediction of a row only depends on the rows with the same sequence and generator, so only the rows 
+    of the (sequence, generator) groups with a changed posterior weight, or with rows of an affected participant, are predicted again. The
+    k-fold shuffles all participants into new folds, so it is simply done again.
+    """
+    key = ['seq_id', 'generator']
 
-        # append the current mean
-        means.append(curMean)
+    # the posterior weight and weighted prediction of every row before and after, rows of new participants had no weight before
+    def weights(data):
+        w = data['posterior'].where(data['correct'].astype(bool), 0)
+        return pd.DataFrame({'p_id' : data['p_id'], 'seq_id' : data['seq_id'], 'generator' : data['generator'].astype(str), 'w' : w,
+                             'wm' : w * data['m_pred'].astype(int)})
+    both = pd.merge(weights(CVResults), weights(bestRules), on=['p_id'] + key, how='outer', suffixes=('_old', '')).fillna(0)
+    changed = ~np.isclose(both['w_old'], both['w']) | ~np.isclose(both['wm_old'], both['wm']) | both['p_id'].isin(affected)
+    groups = pd.MultiIndex.from_frame(both.loc[changed, key]).unique()
 
-    print(len(all_predictions))
-    print("Mean accuracy of LOOCV:", stat.mean(means))
-    return stat.mean(means), all_predictions
+    # predict the rows of the changed groups again, the other rows keep their prediction
+    rows = pd.MultiIndex.from_arrays([bestRules['seq_id'], bestRules['generator'].astype(str)]).isin(groups)
+    old = pd.merge(bestRules[['p_id', 'seq_id']], CVResults[['p_id', 'seq_id', 'BayLOOCV_pred']], on=['p_id', 'seq_id'], how='left')
+    LOOCVpredictions = old['BayLOOCV_pred'].fillna(0).to_numpy().astype(np.uint8)
+    LOOCVpredictions[rows] = bmaPredict(bestRules[rows], bestRules['p_id'][rows])
+    print("Rows predicted again by LOOCV:", rows.sum(), "of", len(rows))
 
-# perform both cross-validation methods
-kfCV_mean, kfoldpredictions = kfoldCV(bestRules)
-LOOCV_mean, LOOCVpredictions = leaveOneOutCV(bestRules)
+    kfCV_mean, kfoldpredictions = kfoldCV(bestRules, k, seed)
 
-# store the results of both validation methods
-bestRules = pd.merge(bestRules, kfoldpredictions, on=['p_id', 'sequence'], how='inner')
-bestRules.insert(9,"BayLOOCV_pred", LOOCVpredictions)
+    # store the results of both validation methods, in the same way as crossValidate
+    bestRules = pd.merge(bestRules, kfoldpredictions, on=['p_id', 'seq_id'], how='inner')
+    bestRules['BayLOOCV_pred'] = LOOCVpredictions
 
-# save the data
-bestRules.to_csv("../Data/CVResults2B.csv", index=False)
+    return bestRules
 
 # Used to check the generalizability of each rule on all other rules
-def singleRuleValidation(data):
+def singleRuleValidation(results, rules, data, path=None, exclude_own=True):
     """
-    This fucntion applies the rule of every participant to every other participants data to test their accuracy.
+    This fucntion applies the rule of every participant in results to the data of every participant in data, which can also be the data 
+    of another study, and returns the accuracy of each rule (rows) on the data of each participant (columns). Every rule is only evaluated
+    once over all 256 sequences, as its truth table in the rule dictionary, after which its predictions are looked up. The matrix is stored
+    in a compressed .npz if a path is given. The mean accuracy of a rule leaves out the data of its own participant if exclude_own is True,
+    which should be False when data is another study, as the participants of every study are numbered from 1.
     """
-    means = pd.DataFrame({'p_id' : [], 'rule' : [], 'mean' : []})
-
-    # loop k amount of times
-    for par in data['p_id'].unique():
-
-        # create a new column called for the infered predictions
-        Inf_pred = []
+    # get the rule of every participant and its truth table
+    owners = results[['p_id', 'rule_id']].drop_duplicates('p_id')
+    tables = ruleTables(rules)[owners['rule_id'].to_numpy()]
+
+    # look up the predictions of every rule for every row of the data, and whether they equal the prediction of the participant
+    correct = tables[:, data['seq_id'].to_numpy()] == data['p_pred'].to_numpy()
+
+    # average the correct predictions over the rows of each participant in the data
+    col, participants = pd.factorize(data['p_id'])
+    onehot = np.zeros((len(data), len(participants)))
+    onehot[np.arange(len(data)), col] = 1
+    n = onehot.sum(axis=0)
+    accuracy = correct @ onehot / n
+
+    # the accuracy of each rule on the data of all other participants, so leaving out its own participant if it is in the data
+    own = pd.Index(participants).get_indexer(owners['p_id']) if exclude_own else np.full(len(owners), -1)
+    hits = accuracy * n
+    others = np.where(own >= 0, (hits.sum(axis=1) - hits[np.arange(len(own)), own]) / (n.sum() - n[own]), hits.sum(axis=1) / n.sum())
+    means = pd.DataFrame({'p_id' : owners['p_id'].to_numpy(), 'rule' : rules['rule'].to_numpy()[owners['rule_id']], 'mean' : others})
 
-        test = data[data['p_id'] == par]
+    print("Mean accuracy of Single Rule Validation:", stat.mean(means['mean']))
+    print(means)
 
-        train = data[data['p_id'] != par]
+    if path:
+        np.savez_compressed(path, accuracy=accuracy.astype(np.float32), rule_p_id=owners['p_id'].to_numpy(), data_p_id=np.asarray(participants))
 
-        # go over all the data minus one
-        for i in range(train.shape[0]):
+    return pd.DataFrame(accuracy, index=owners['p_id'].to_numpy(), columns=participants), means
 
-            # get the sequence, and define it as x for the evaluation rules for the current sequence
-            x = train.iloc[i]['sequence']
+# only run this code if the program is run with this file as the main
+if __name__ == '__main__':
 
-            # evaluate the rule of the current participant, if the rule did not already make a prediction for that sequence.
-            if x in test['sequence']:
-                Inf_pred.append(test[test['sequence'] == par]['m_pred'])
-            else: Inf_pred.append(eval(test[test['p_id'] == par]['rule'].iloc[0]))
+    # get the data from the best rules, with the rules and sequences as ids
+    bestRules, rules = loadResults("../Data/BestRules2B")
 
-        # add the predictions of the train data to the test dataframe
-        train.insert(8,"inf_pred", Inf_pred)
+    # perform both cross-validation methods
+    CVResults, summary = crossValidate(bestRules)
 
-        curMean = stat.mean(train['p_pred'] == train['inf_pred'])
-        print("Participant: ", par, "Mean: ", curMean)
+    # save the data, also as csv for the R plots, and the accuracy of the repeated k-fold with its confidence interval
+    saveResults("../Data/CVResults2B", CVResults, rules, csv=True)
+    with open("../Data/CVSummary2B.json", 'w') as f:
+        json.dump(summary, f, indent=2)
 
-        # compute the mean accuracy for this k-fold
-        means = pd.concat([means, pd.DataFrame({'p_id' : par, 'rule' : test['rule'].unique(), 'mean' : curMean})])
+    # check how well the rule of every participant generalizes to every other participant
+    singleRuleValidation(CVResults, rules, CVResults, "../Data/RuleMatrix2B.npz")
 
-    print("Mean accuracy of Single Rule Validation:", stat.mean(means['mean']))
-    print(means)
+    # and how well the rules of study 1B generalize to the participants of study 2B, who are different people with the same ids
+    singleRuleValidation(*loadResults("../Data/BestRules1B"), bestRules, "../Data/RuleMatrix1Bon2B.npz", exclude_own=False)
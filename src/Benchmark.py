@@ -0,0 +1,231 @@
+import os
+import io
+import sys
+import json
+import time
+import random
+import platform
+import argparse
+import subprocess
+import contextlib
+import numpy as np
+import pandas as pd
+import Primitives
+from Primitives import SEQS
+from LoT import MyHypothesis, MetropolisHastingsSampler, decodeTrials, encodeTrials
+from Packed import packedPrimitives, compilePacked
+from LoadData import loadStudy
+from Results import loadResults, normalize
+from BestRule import predictOutcome, selectBestRules
+from BayInf import kfoldCV, leaveOneOutCV
+
+# the folder with the data, where the results of the LoT model are read from
+DATA = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'Data')
+
+# the arguments of every primitive, they are all called on each of the 256 sequences with every value of their other argument
+PRIMITIVES = {'invert_' : [()], 'get_' : [(0,), (7,)], 'streak_' : [(n,) for n in range(7)], 'patternCont_' : [()],
+              'balance_' : [(n,) for n in range(1, 5)], 'conform_' : [(n,) for n in range(1, 5)]}
+
+# the modules whose import is timed: the runtime primitives, the analysis scripts, which are also what a worker process of the cross
+# validation imports, and the LoT model for the fitting
+IMPORTS = ['Primitives', 'Results', 'BestRule', 'BayInf', 'InterpretRule', 'Service', 'LoT']
+
+def measure(fn, number, repeats=5):
+    """
+    Time fn, which runs number operations, repeats times and return the operations per second of the fastest repeat, which is the
+    least disturbed by other processes, together with the median.
+    """
+    times = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        fn()
+        times.append(time.perf_counter() - start)
+    return {'ops_per_sec' : number / min(times), 'median_ops_per_sec' : number / float(np.median(times)), 'number' : number,
+            'repeats' : repeats}
+
+def quiet(fn):
+    # run fn without its printed output, as the cross validation prints every fold
+    def run():
+        with contextlib.redirect_stdout(io.StringIO()):
+            return fn()
+    return run
+
+def primitiveBenchmarks():
+    # every primitive on all sequences, else_ is benchmarked on the outputs of the other primitives
+    benches = {}
+    for name, argsets in PRIMITIVES.items():
+        fn = getattr(Primitives, name)
+        calls = [(x,) + args for x in SEQS for args in argsets]
+        benches['primitive/' + name] = (lambda fn=fn, calls=calls: [fn(*c) for c in calls], len(calls))
+
+    pairs = [(r, r2) for r in ['0', '1', False, None] for r2 in ['0', '1', False, None]] * 64
+    benches['primitive/else_'] = (lambda: [Primitives.else_(r, r2) for r, r2 in pairs], len(pairs))
+    return benches
+
+def packedBenchmarks(lengths, seed):
+    """
+    Every bit packed primitive on random sequences of each length, with the arguments the grammar of that length gives it, and a rule
+    that uses all of them. The operations per second should stay the same as the sequences get longer.
+    """
+    rng = random.Random(seed)
+    benches = {}
+    for length in lengths:
+        prims = packedPrimitives(length)
+        xs = [rng.getrandbits(length) for _ in range(256)]
+        argsets = {'get_' : [(0,), (length - 1,)], 'streak_' : [(n,) for n in range(length - 1)], 'patternCont_' : [()],
+                   'balance_' : [(n,) for n in range(1, length // 2 + 1)], 'conform_' : [(n,) for n in range(1, length // 2 + 1)]}
+        for name, args in argsets.items():
+            fn = getattr(prims, name)
+            calls = [(x,) + a for x in xs for a in args]
+            benches['packed/' + name + '/' + str(length)] = (lambda fn=fn, calls=calls: [fn(*c) for c in calls], len(calls))
+
+        rule = compilePacked("lambda x: else_(patternCont_(x), else_(invert_(streak_(x, 2)), else_(balance_(x, 2), get_(x, " +
+                             str(length - 1) + "))))", length)
+        benches['packed/rule/' + str(length)] = (lambda rule=rule, xs=xs: [rule(x) for x in xs], len(xs))
+    return benches
+
+def importBenchmarks(modules=IMPORTS):
+    # the start of a new python process that imports a module, as an analysis script or a worker process does
+    src = os.path.dirname(os.path.abspath(__file__))
+    run = lambda module: subprocess.run([sys.executable, '-c', 'import ' + module], cwd=src, check=True)
+    return {'import/' + module : (lambda module=module: run(module), 1) for module in modules}
+
+def importProfile(module, top=10):
+    """
+    The imports that take the most time when a module is imported in a new python process, from the output of python -X importtime, as
+    a list of the cumulative time in seconds and the name of every imported module, the slowest first.
+    """
+    src = os.path.dirname(os.path.abspath(__file__))
+    out = subprocess.run([sys.executable, '-X', 'importtime', '-c', 'import ' + module], cwd=src, check=True, capture_output=True,
+                         text=True).stderr
+    times = []
+    for line in out.splitlines()[1:]:
+        _, cumulative, name = line.split('|')
+        times.append((int(cumulative) / 1e6, name.rstrip()))
+    return sorted(times, reverse=True)[:top]
+
+def likelihoodBenchmarks(trials, seed):
+    # the likelihood of a single datum as in LOTlib3, and of all data of a participant with the compiled truth table, for a rule that is
+    # generated from the grammar with a fixed seed
+    random.seed(seed)
+    h = MyHypothesis()
+    data = decodeTrials(trials)
+
+    benches = {'likelihood/compute_single_likelihood' : (lambda: [h.compute_single_likelihood(d) for d in data], len(data))}
+
+    def compiled():
+        # a fresh copy of the data every repeat, so the memo of earlier repeats is not used
+        fresh = decodeTrials(trials)
+        for _ in range(1000):
+            fresh.memo.clear()
+            h.compute_likelihood(fresh)
+    benches['likelihood/compute_likelihood_compiled'] = (compiled, 1000)
+    return benches
+
+def samplerBenchmark(trials, steps, seed):
+    # a Metropolis-Hastings run of a fixed number of steps, with a fixed seed so every run proposes the same hypotheses
+    def run():
+        random.seed(seed)
+        np.random.seed(seed)
+        data = decodeTrials(trials)
+        for h in MetropolisHastingsSampler(MyHypothesis(), data, steps=steps):
+            pass
+    return {'sampler/mh_steps' : (run, steps)}
+
+def analysisBenchmarks(experiment):
+    # the best rule selection and both cross validation methods, on the stored results of the LoT model
+    mvData, rules = loadResults(os.path.join(DATA, 'LoT' + experiment))
+    study = loadStudy(experiment)
+
+    # the input of predictOutcome, built in the same way as in selectBestRules
+    rdata, _ = normalize(study.rename(columns = {'participant_id' : 'p_id', 'prediction_raw' : 'p_pred'})
+                         .loc[:, ['p_id', 'sequence', 'p_pred', 'generator']])
+    results = pd.merge(rdata, mvData[['p_id', 'rule_id', 'posterior']], on = 'p_id')
+    bestRules = quiet(lambda: selectBestRules(mvData, rules, study))()
+
+    return {'analysis/predictOutcome' : (lambda: predictOutcome(results, rules), len(results)),
+            'analysis/selectBestRules' : (quiet(lambda: selectBestRules(mvData, rules, study)), len(mvData)),
+            'analysis/kfoldCV' : (quiet(lambda: kfoldCV(bestRules, verbose=False)), len(bestRules)),
+            'analysis/leaveOneOutCV' : (quiet(lambda: leaveOneOutCV(bestRules)), len(bestRules))}
+
+def runBenchmarks(experiment='1B', steps=2000, seed=7331, repeats=5, only=None, lengths=(8, 16, 24, 32)):
+    """
+    Run all benchmarks and return their results as a dictionary from the name of the benchmark to its operations per second. The
+    benchmarks that use data take the participant with the most trials of the study. Only runs the benchmarks whose name starts with only
+    if it is given. The packed primitives are benchmarked for sequences of each of the lengths.
+    """
+    study = loadStudy(experiment)
+    counts = study['participant_id'].value_counts()
+    trials = encodeTrials(study[study['participant_id'] == counts.index[0]])
+
+    benches = {}
+    benches.update(importBenchmarks())
+    benches.update(primitiveBenchmarks())
+    benches.update(packedBenchmarks(lengths, seed))
+    benches.update(likelihoodBenchmarks(trials, seed))
+    benches.update(samplerBenchmark(trials, steps, seed))
+    benches.update(analysisBenchmarks(experiment))
+
+    results = {}
+    for name, (fn, number) in benches.items():
+        if only and not name.startswith(only):
+            continue
+        fn()
+        results[name] = measure(fn, number, repeats)
+        print(name.ljust(45), str(round(results[name]['ops_per_sec'], 1)).rjust(14), "ops/sec")
+    return results
+
+def compare(results, baseline, tolerance):
+    """
+    Compare the results to a baseline, and return the benchmarks that are slower than the baseline by more than the tolerance (a
+    fraction), with their ratio to the baseline.
+    """
+    slower = {}
+    for name, result in results.items():
+        if name in baseline['results']:
+            ratio = result['ops_per_sec'] / baseline['results'][name]['ops_per_sec']
+            if ratio < 1 - tolerance:
+                slower[name] = ratio
+    return slower
+
+# only run this code if the program is run with this file as the main
+if __name__ == '__main__':
+
+    # run the benchmarks, write the results as json and optionally fail if they are slower than a stored baseline
+    parser = argparse.ArgumentParser(description='Benchmark the primitives, the likelihood, the sampler and the analysis.')
+    parser.add_argument('--experiment', default='1B')
+    parser.add_argument('--steps', type=int, default=2000)
+    parser.add_argument('--seed', type=int, default=7331)
+    parser.add_argument('--repeats', type=int, default=5)
+    parser.add_argument('--only', default=None, help='only run the benchmarks whose name starts with this, e.g. primitive/')
+    parser.add_argument('--lengths', type=int, nargs='+', default=[8, 16, 24, 32], help='the sequence lengths of the packed primitives')
+    parser.add_argument('--importtime', nargs='+', default=[], help='print the slowest imports of these modules, e.g. BestRule')
+    parser.add_argument('--output', default=None, help='write the results to this json file')
+    parser.add_argument('--baseline', default=None, help='a json file of an earlier run to compare against')
+    parser.add_argument('--tolerance', type=float, default=0.25, help='the fraction a benchmark may be slower than the baseline')
+    args = parser.parse_args()
+
+    # show where the time of importing a module goes
+    for module in args.importtime:
+        print("Slowest imports of", module)
+        for seconds, name in importProfile(module):
+            print(str(round(seconds * 1000, 1)).rjust(10), "ms", name)
+
+    results = runBenchmarks(args.experiment, args.steps, args.seed, args.repeats, args.only, args.lengths)
+    report = {'meta' : {'time' : time.strftime('%Y-%m-%dT%H:%M:%S'), 'python' : platform.python_version(), 'numpy' : np.__version__,
+                        'pandas' : pd.__version__, 'machine' : platform.machine(), 'processor' : platform.processor(),
+                        'experiment' : args.experiment, 'steps' : args.steps, 'seed' : args.seed, 'lengths' : args.lengths}, 'results' : results}
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+
+    # fail when a benchmark got slower than the baseline
+    if args.baseline:
+        with open(args.baseline) as f:
+            slower = compare(results, json.load(f), args.tolerance)
+        for name, ratio in slower.items():
+            print("Regression:", name, "runs at", round(ratio * 100, 1), "% of the baseline")
+        if slower:
+            sys.exit(1)
+        print("No regressions compared to", args.baseline)
@@ -1,28 +1,20 @@
 import pandas as pd
-import re
 import statistics as stat
 import math
-from LoT import else_, streak_, conform_, get_, patternCont_, balance_, bin_str
+import numpy as np
+from Primitives import patterns, SEQS, ONE
+from LoadData import loadStudy
+from Results import loadResults, normalize, ruleTables
 
-def predictOutcome(results):
+def predictOutcome(results, rules):
     """
     This function takes the results and adds a new column to it with the prediction that the found rule would make for each sequence. It also
-    creates adds a second column that indicates whether the participants prediction and models prediction are the same.
+    creates adds a second column that indicates whether the participants prediction and models prediction are the same. The rules and 
+    sequences of the results are given by their ids (rule_id and seq_id), and the prediction is looked up in the truth tables of the rule
+    dictionary, giving the code of the output of the rule.
     """
-    # keep track of the predictions
-    pred = []
-
-    # go over each row
-    for i in range(results.shape[0]):
-
-        # define the sequence as x for the rule
-        x = results['sequence'].iloc[i]
-
-        # evaluate the rule on the current sequence and store the result
-        pred.append(eval(results['rule'].iloc[i]))
-
-    # load in the models predictions
-    results['m_pred'] = pred
+    # look up the prediction of the rule of each row for its sequence
+    results['m_pred'] = ruleTables(rules)[results['rule_id'].to_numpy(), results['seq_id'].to_numpy()]
 
     # add a column to indicate whether the participants answer is congruent with our models prediction
     results['correct'] = results['m_pred'] == results['p_pred']
@@ -32,70 +24,135 @@ def predictOutcome(results):
 
 def bestRule(results):
     """
-    This function gets the best rules from the given results, it does so by creating a new dataframe which contains only the 
-    p_id, rule, mean, and posterior, sorting that dataframe by mean and then posterior and then grabbing the first occurance of every participant.
+    This function gets the best rules from the given results, the rule of the first row with the highest posterior of every participant, and
+    keeps all rows of each participant with its best rule. The best row of every participant is found with a single groupby, which picks the
+    same row as taking the largest posterior of each participant in turn.
     Note that this is actually a bit unneccesary as simply grabbing the top posterior score would be better after the change to the likelihood 
     function in LoT.py which weighs the likelihood heavier so that the prior never becomes more important than the likelihood. 
     """
-
-    # get only the relevant columns
-    bRule = results[['p_id', 'rule', 'posterior']]
-
-    # create a empty list for the best rules
-    bestRules = pd.DataFrame({'p_id' : [], 'rule' : []})
-
-    # loop over each participant
-    for p in pd.unique(bRule['p_id']):
-        parDat = bRule[bRule['p_id'] == p]
-
-        # add the single rowed dataframe of the current participant to the rest
-        bestRules = pd.concat([bestRules, parDat.nlargest(1, 'posterior').drop(columns = 'posterior')])
+    # the row with the highest posterior of each participant, on a tie the first
+    first = results.groupby('p_id', sort=False)['posterior'].idxmax()
+    best = pd.Series(results.loc[first, 'rule_id'].to_numpy(), index=results.loc[first, 'p_id'].to_numpy())
 
     # get the subset the results dataframe by only retaining the best rule for each participant
-    bestRules =  pd.merge(results, bestRules, on=['p_id', 'rule'], how='inner')
+    keep = results['rule_id'].to_numpy() == best.reindex(results['p_id']).to_numpy()
+    return results[keep].reset_index(drop=True)
 
-    return bestRules
-
-# only run this code if the program is run with this file as the main
-if __name__ == '__main__':
-    print(len(bin_str))
-
-    # load in LoT model results
-    mvData = pd.read_csv("../Data/LoT1B.csv")
+def posteriorWeights(mvData):
+    """
+    The posterior probability of every rule in the results of the LoT model (mvData) for its participant. The log posteriors of the TopN
+    rules of a participant are normalized with log-sum-exp, so the weights of every participant sum to one, whatever the posteriors of
+    the other participants are.
+    """
+    post = mvData['posterior'].astype(float)
+    w = np.exp(post - post.groupby(mvData['p_id']).transform('max'))
+    return (w / w.groupby(mvData['p_id']).transform('sum')).to_numpy()
 
-    # remove unnessesary string elements
-    mvData['rule'] = [re.sub('"', '', rule)[10:] for rule in mvData['rule']]
+def bmaPredictions(mvData, rules):
+    """
+    The Bayesian model averaged prediction of every participant on all 256 sequences, over all TopN rules of the participant weighted by
+    posteriorWeights. Returns the participants and an array with a row per participant and a column per sequence, holding the probability
+    that the participant predicts a 1. A rule that gives no bit for a sequence counts as a random guess.
+    """
+    participants = pd.unique(mvData['p_id'])
+    row = pd.Index(participants).get_indexer(mvData['p_id'])
+    w = posteriorWeights(mvData)
+    rule = mvData['rule_id'].to_numpy()
+
+    # the probability of a 1 for every rule and sequence
+    tables = ruleTables(rules)
+    ones = (tables == ONE) + 0.5 * (tables > ONE)
+
+    # add the rules rank by rank, so every participant gets at most one rule in each step
+    rank = mvData.groupby('p_id', sort=False).cumcount().to_numpy()
+    P = np.zeros((len(participants), len(SEQS)))
+    for r in range(rank.max() + 1 if len(rank) else 0):
+        at = rank == r
+        P[row[at]] += w[at, None] * ones[rule[at]]
+    return participants, P
+
+def selectBestRules(mvData, rules, study_data, participants=None):
+    """
+    Use the rules found by the LoT model (mvData, with rule ids into the dictionary rules) to predict the outcome for every sequence of the
+    study, and keep only the best rule of each participant. If participants is given, only the best rules of those participants are
+    selected, with the posterior still scaled over all of mvData. Every row also gets the posterior weight of the best rule among the
+    TopN rules of its participant (weight), and the model averaged prediction of the participant over all those rules (bma_pred).
+    """
+    # the model averaged predictions of every participant, from the unscaled posteriors of all their rules
+    owners, P = bmaPredictions(mvData if participants is None else mvData[mvData['p_id'].isin(participants)], rules)
+    weights = mvData[['p_id', 'rule_id']].assign(weight=posteriorWeights(mvData)).drop_duplicates(['p_id', 'rule_id'])
 
     # change the unnormalized posterior to probabilities
+    mvData = mvData.copy()
     pmin = mvData['posterior'].min()
     mvData['posterior'] = (mvData['posterior'] - pmin) / (mvData['posterior'].max() - pmin)
 
-    # Load in the whole Excel file
-    all_data = pd.ExcelFile("../Data/PredictingOutcomes_ParticipantPredictions.xlsx")
-
-    # extract the worksheet of the study, and ensure the type of the sequence and prediction is a string
-    study_data = pd.read_excel(all_data, 'Study 1B', dtype={"sequence": str, "prediction_raw": str})
+    if participants is not None:
+        mvData = mvData[mvData['p_id'].isin(participants)]
+        study_data = study_data[study_data['participant_id'].isin(participants)]
 
     # rename the participant ID column
     study_data = study_data.rename(columns = {'participant_id' : 'p_id', 'prediction_raw' : 'p_pred'})
         
-    # get the relevant data columns
-    rdata = study_data.loc[:, ['p_id', 'sequence', 'p_pred', 'generator']]
+    # get the relevant data columns, with the sequences as ids
+    rdata, _ = normalize(study_data.loc[:, ['p_id', 'sequence', 'p_pred', 'generator']])
 
     # merge the dataframes
-    results = pd.merge(rdata, mvData[['p_id', 'rule', 'posterior']], on = 'p_id')
+    results = pd.merge(rdata, mvData[['p_id', 'rule_id', 'posterior']], on = 'p_id')
 
     # use the found rules of each participant to predict the outcome for their sequences
-    results_pred = predictOutcome(results)
+    results_pred = predictOutcome(results, rules)
 
     # get the best rules from the results - NOTE: This function selected a simpler rule that has a higher likelihood than a complexer rule in 1B
-    BRule  = bestRule(results_pred)
+    BRule = bestRule(results_pred)
+
+    # add the posterior weight of the best rule and the model averaged prediction of the participant on the sequence
+    BRule['weight'] = pd.merge(BRule[['p_id', 'rule_id']], weights, on=['p_id', 'rule_id'], how='left')['weight'].to_numpy()
+    BRule['bma_pred'] = (P[pd.Index(owners).get_indexer(BRule['p_id']), BRule['seq_id'].to_numpy()] >= 0.5).astype(np.uint8)
+    return BRule
+
+def updateBestRules(BRule, mvData, rules, study_data, affected):
+    """
+    Update stored best rules (BRule) after the LoT model results (mvData) of the affected participants changed, see LoT.refitStudy. Only the
+    best rules of the affected participants are selected again, the others keep their rows, of which only the posterior is scaled again,
+    as the scale depends on the posteriors of all participants.
+    """
+    keep = BRule[~BRule['p_id'].isin(affected)].drop(columns='posterior')
+
+    # the posterior of the rules that are kept, scaled in the same way as in selectBestRules
+    pmin = mvData['posterior'].min()
+    scaled = mvData[['p_id', 'rule_id', 'posterior']].drop_duplicates(['p_id', 'rule_id'])
+    scaled = scaled.assign(posterior=(scaled['posterior'] - pmin) / (mvData['posterior'].max() - pmin))
+    keep = pd.merge(keep, scaled, on=['p_id', 'rule_id'], how='left')[BRule.columns]
+
+    # the new best rules of the affected participants, with all rows ordered by the participants in the study
+    update = selectBestRules(mvData, rules, study_data, affected)[BRule.columns]
+    numeric = {col : t for col, t in keep.dtypes.items() if not isinstance(t, pd.CategoricalDtype)}
+    BRule = pd.concat([keep, update.astype(numeric)], ignore_index=True)
+    for col in keep.columns.difference(list(numeric)):
+        BRule[col] = pd.Categorical(BRule[col].astype(str))
+    order = pd.Index(pd.unique(study_data['participant_id']))
+    return BRule.iloc[np.argsort(order.get_indexer(BRule['p_id']), kind='stable')].reset_index(drop=True)
+
+# only run this code if the program is run with this file as the main
+if __name__ == '__main__':
+    print(len(patterns()))
+
+    # load in LoT model results, with the rules as ids into the rule dictionary
+    mvData, rules = loadResults("../Data/LoT1B")
+
+    # load the worksheet of the study, from the cache if the workbook did not change since it was last read
+    study_data = loadStudy('1B')
+
+    # get the best rules of each participant
+    BRule = selectBestRules(mvData, rules, study_data)
 
-    # print the total average accuracy
+    # print the total average accuracy, of the best rules and of the model average over all rules of every participant
     print(BRule['correct'].mean())
+    print((BRule['bma_pred'] == BRule['p_pred']).mean())
 
     # print the mean accuracy of each participant
     #print(BRule.groupby(['p_id'])['correct'].mean().to_string())
 
-    # store the data of the best rules
-    #BRule.to_csv("../Data/BestRules1B.csv", index=False)
\ No newline at end of file
+    # store the data of the best rules, also as csv for the R plots
+    #saveResults("../Data/BestRules1B", BRule, rules, csv=True)
\ No newline at end of file
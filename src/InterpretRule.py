@@ -1,26 +1,33 @@
 import pandas as pd
 import numpy as np
 import statistics as stat
-import re
+from functools import lru_cache
+from Results import loadResults
+from Primitives import parseRule, tableOf, asTable, SEQS, FALSE
 
-# get the results from both model version for each experiment
-bestRules_1B = pd.read_csv("../Data/BestRules1B.csv", dtype={"sequence": str, "p_pred": str, "m_pred": str})
-bestRules_2B = pd.read_csv("../Data/BestRules2B.csv", dtype={"sequence": str, "p_pred": str, "m_pred": str})
+# the primitives that can produce a prediction in a link of an else_ chain, where bit stands for a constant '0' or '1'
+PRIMITIVES = ['get_', 'streak_', 'balance_', 'conform_', 'patternCont_', 'bit']
+
+def names(tree):
+    # the names of the primitives in a parsed rule, in the order in which they appear in the rule
+    if tree[0] in ('x', 'int', 'bit'):
+        return []
+    return [tree[0]] + [n for arg in tree[1] for n in names(arg)]
 
 # This follow part contains the rule importance code, which extracts the importance of a rule depending how early it is in the rule.
+@lru_cache(maxsize=65536)
 def extract_rules(s):
     """
-    Extract rule names ending in '_' from a function-like string.
+    Extract rule names ending in '_' from a function-like string. The rule is parsed once (see Primitives.parseRule) and the names are cached.
     """
-    pattern = re.compile(r'(\w+_)\(')
-    return pattern.findall(s)
+    return names(parseRule(s))
 
 def rule_importance(strings, rule_name):
     """
     Compute the importance of a rule, for a given string. If the rule is present in the string, give it a score of 1 to 0, with x > 0, 
     and 0 if it does not appear in the string. Note that x depends on the number of rules within a string, as shorter strategies rely more on
     its individual rules than longer strategies. Furthmore, the importance can be quantified more thuroughly by checking how often it is 
-    responsible for a prediction, but is much more extensive to compute.
+    responsible for a prediction, which is done by rule_responsibility.
     """
     results = []
 
@@ -45,22 +52,107 @@ def rule_importance(strings, rule_name):
     return results
 
 
-# get only the participant id's and their rule, and drop duplicates
-BR2B = bestRules_2B.loc[:, ['p_id', 'rule']].drop_duplicates()
-BR1B = bestRules_1B.loc[:, ['p_id', 'rule']].drop_duplicates()
+def chainLinks(tree):
+    # split a parsed rule into the links of its else_ chain, the last link is the rule that is used when all others return False
+    links = []
+    while tree[0] == 'else_':
+        links.append(tree[1][0])
+        tree = tree[1][1]
+    return links + [tree]
+
+def linkPrimitive(link):
+    # the primitive that produces the output of a link, looking through invert_, or bit for a constant
+    while link[0] == 'invert_':
+        link = link[1][0]
+    return link[0]
+
+@lru_cache(maxsize=65536)
+def firedLinks(rule):
+    """
+    Find which link of the else_ chain of a rule produces its output for each of the 256 sequences, i.e. the first link that does not 
+    return False, or the last link if all others do. The truth tables of all links are computed at once, so the rule is never called on a
+    single sequence. Returns the primitive of every link and the position of the link that fired for every sequence, which is cached for
+    every rule.
+    """
+    links = chainLinks(parseRule(rule))
+    tables = np.array([np.broadcast_to(asTable(tableOf(link)), len(SEQS)) for link in links])
+
+    # the first link that does not return False, where the last link always counts as returning something
+    returns = np.vstack([tables[:-1] != FALSE, np.ones((1, len(SEQS)), dtype=bool)])
+    fired = returns.argmax(axis=0)
+    return [linkPrimitive(link) for link in links], fired.astype(np.uint8)
+
+def rule_responsibility(bestRules, rules):
+    """
+    Compute how often each primitive is responsible for the prediction of the best rule of every participant, on the sequences the 
+    participant saw, i.e. the fraction of their trials on which a link with that primitive fired. Returns one row per participant with 
+    a column per primitive (without the trailing '_').
+    """
+    # the primitive that fired for every row, looked up in the fired links of the rule of the row
+    exprs = rules['rule'].to_numpy()
+    ids = pd.unique(bestRules['rule_id'])
+    fired = np.zeros((len(ids), len(SEQS)), dtype=int)
+    for i, rid in enumerate(ids):
+        prims, links = firedLinks(exprs[rid])
+        fired[i] = np.array([PRIMITIVES.index(p) for p in prims])[links]
+    rows = fired[pd.Index(ids).get_indexer(bestRules['rule_id']), bestRules['seq_id'].to_numpy()]
+
+    # the fraction of the rows of every participant for which each primitive fired
+    counts = pd.crosstab(bestRules['p_id'].to_numpy(), rows, normalize='index').reindex(columns=range(len(PRIMITIVES)), fill_value=0)
+    counts.columns = [p.rstrip('_') for p in PRIMITIVES]
+    owners = bestRules[['p_id', 'rule_id']].drop_duplicates('p_id')
+    return pd.concat([pd.DataFrame({'p_id' : owners['p_id'].to_numpy(), 'rule' : exprs[owners['rule_id']]}), 
+                      counts.loc[owners['p_id']].reset_index(drop=True)], axis=1)
+
+def ruleResponsibility(studies):
+    """
+    Compute the responsibility of every primitive (see rule_responsibility) for every participant of each study in studies, which is a
+    dictionary from the experiment to its best rules and rule dictionary, in the same format as ruleInterpretation.
+    """
+    frames = []
+    for experiment, (bestRules, rules) in studies.items():
+        resp = rule_responsibility(bestRules, rules)
+        resp.insert(2, 'experiment', experiment)
+        frames.append(resp)
+    return pd.concat(frames)
+
+def ruleInterpretation(studies):
+    """
+    Compute the importance of balance_ and conform_ in the best rule of every participant, for each study in studies, which is a dictionary
+    from the experiment to its best rules and rule dictionary. Returns the data for the rule interpretation plot.
+    """
+    frames = []
+    for experiment, (bestRules, rules) in studies.items():
+
+        # get only the participant id's and their rule, and drop duplicates
+        BR = bestRules.loc[:, ['p_id', 'rule_id']].drop_duplicates()
+
+        # look up the expression of each rule in the dictionary
+        BR = pd.DataFrame({'p_id' : BR['p_id'], 'rule' : rules['rule'].to_numpy()[BR['rule_id']]})
+
+        # add an extra column to indicate the experiment
+        BR['experiment'] = experiment
+
+        # compute the rule importance of balance and conform, and add the results in an extra column
+        BR['balance'] = rule_importance(BR['rule'], 'balance_')
+        BR['conform'] = rule_importance(BR['rule'], 'conform_')
+
+        frames.append(BR)
+
+    # add the dataframes together
+    return pd.concat(frames)
 
-# add an extra column to indicate the experiment
-BR2B['experiment'] = '2B'
-BR1B['experiment'] = '1B'
+# only run this code if the program is run with this file as the main
+if __name__ == '__main__':
 
-# compute the rule importance of balance and conform, and add the results in an extra column
-BR2B['balance'] = rule_importance(BR2B['rule'], 'balance_')
-BR1B['balance'] = rule_importance(BR1B['rule'], 'balance_')
-BR1B['conform'] = rule_importance(BR1B['rule'], 'conform_')
-BR2B['conform'] = rule_importance(BR2B['rule'], 'conform_')
+    # get the results from both model version for each experiment, with their rule dictionaries
+    studies = {'2B' : loadResults("../Data/BestRules2B"), '1B' : loadResults("../Data/BestRules1B")}
 
-# add the two dataframes together
-ruleIntPlot = pd.concat([BR2B, BR1B])
+    # save data to plot for rule interpretation
+    ruleIntPlot = ruleInterpretation(studies)
+    ruleIntPlot.to_csv("../Data/ruleIntPlotData.csv", index=False)
 
-# save data to plot for rule interpretation
-ruleIntPlot.to_csv("../Data/ruleIntPlotData.csv", index=False)
\ No newline at end of file
+    # save how often each primitive produced the predictions of the participants, and print its mean per experiment
+    ruleRespPlot = ruleResponsibility(studies)
+    ruleRespPlot.to_csv("../Data/ruleRespPlotData.csv", index=False)
+    print(ruleRespPlot.drop(columns=['p_id', 'rule']).groupby('experiment').mean())
@@ -8,142 +8,207 @@ from LOTlib3.Hypotheses.Priors.RationalRules import RationaRulesPrior
 from LOTlib3.Hypotheses.Likelihoods.BinaryLikelihood import BinaryLikelihood
 from LOTlib3.Eval import primitive
 from LOTlib3.Miscellaneous import qq
-from LOTlib3.TopN import TopN
 from LOTlib3.Samplers.MetropolisHastings import MetropolisHastingsSampler
 from joblib import Parallel, delayed
 import multiprocessing
-from math import log
+import os
+import pickle
+import time
+import argparse
+from math import log, isclose
+from functools import lru_cache, partial
+from itertools import product, islice
+import numpy as np
 import pandas as pd
+from LoadData import loadStudy
+from Monitor import ChainMonitor, profiled
+from Primitives import (invert_, get_, streak_, patternCont_, balance_, conform_, else_, SEQS, ZERO, ONE, FALSE, encodeOut, asTable,
+                        TABLE_PRIMITIVES, parseRule, compileRule)
 
-@primitive
-def invert_(pat):
+# the string primitives, which are registered with LOTlib3 so the hypotheses of the grammar can call them
+STRING_PRIMITIVES = {fn.__name__ : fn for fn in [invert_, get_, streak_, patternCont_, balance_, conform_, else_]}
+for fn in STRING_PRIMITIVES.values():
+    primitive(fn)
 
-    # this function returns the flipped version of the input e.g., "110" becomes "001", but only if the input is not False
-    if pat:
-        return ''.join('1' if c == '0' else '0' for c in pat)
+# the folder with the data, where the stored results of the LoT model are
+DATA = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'Data')
 
-def createPat():
+class CompiledData(list):
     """
-    This function is used to create the binary strings with patterns that repeat themselves at least once. They are created from all versions
-    of 4 and 3 bit long binary strings that are repeated 2 or three times respectively.
+    A list of FunctionData objects that also stores the data as counts per sequence and prediction. This allows the likelihood of
+    a compiled rule to be computed by a single lookup in its truth table, instead of calling the rule once for each datum.
     """
-    # initialize the lists
-    bit_sets = list()
-    binary_str = list()
+    def __init__(self, data):
+        list.__init__(self, data)
 
-    # create the 16 versions of three bit binary strings
-    for i in range(1 << 4):
-        # Convert the current number to a binary string of length n
-        bit_sets.append(format(i, '0' + str(4) + 'b'))
+        # count how often each prediction is made for each sequence, the FALSE and NONE columns stay empty as those never match
+        self.counts = np.zeros((len(SEQS), 4))
+        for datum in self:
+            if datum.output in ('0', '1'):
+                self.counts[int(datum.input[0], 2), int(datum.output)] += 1
 
-    # repeat the 16 created 4 bit patterns.
-    binary_str = [st * 2 + st[0] for st in bit_sets]
+        # the log likelihood of a correct and incorrect prediction, the same as in MyHypothesis.compute_single_likelihood
+        alpha = self[0].alpha if len(self) else 0.999
+        self.hit = log((1.0-alpha)/100. + alpha)
+        self.miss = log((1.0-alpha)/100)
 
-    # add patterns that are flipped versions
-    binary_str = binary_str + [st + invert_(st) + st[0] for st in bit_sets]
+        # the likelihoods of the behaviours that were already scored, so equivalent rules do not have to be scored again
+        self.memo = {}
 
-    # initialize the lists
-    binary_str3 = list()
-    bit_sets3 = list()
+        # the time spent computing likelihoods on this data, kept for the metrics of the sampler
+        self.seconds = 0.0
 
-    # create the 8 versions of three bit binary strings
-    for i in range(1 << 3):
-        # Convert the current number to a binary string of length n
-        bit_sets3.append(format(i, '0' + str(3) + 'b'))
-    
-    # repeat the 16 created 4 bit patterns.
-    binary_str3 = [st * 3 for st in bit_sets3]
-
-    # add patterns that are flipped versions
-    binary_str3 = binary_str3 + [st + invert_(st) + st for st in bit_sets3]
-
-    # add 3 bit patterns to other 4 bit binary strings
-    for st in binary_str3:
-        if st not in binary_str:
-            binary_str.append(st)
-
-    # return the list of patterned binary strings
-    return binary_str
-
-# create a list with binary strings containing all valid patterns
-bin_str = createPat()
-
-# create primitive that takes a the ith character from the given input string x
-@primitive
-def get_(x, i): 
-    return (x[i])
-
-@primitive
-def streak_(x, i): 
-    if all(list(map(int,list(x[i:8])))):
-        return x[7]
-    return False
-
-@primitive
-def patternCont_(x):
-    """
-    This primitive checks whether x (the input) contains one of the patterned binary strings (bin_str) and returns the 
-    continuation of the pattern. If x is not in bin_str it returns False.
-    """
-
-    # loop over all patterns
-    for pat in bin_str:
-
-        # check if the pattern is present in x and return its continuation
-        if pat[0:8] == x:
-            return pat[8]
-        
-    # otherwise return False
-    return False
-
-# A balance function
-@primitive
-def balance_(x, n): 
-    if x.count("1") < n:
-        return "1"
-    elif x.count("0") < n:
-        return "0"
-    return False
-
-
-@primitive
-def conform_(x, n): 
-    if x.count("1") < n:
-        return "0"
-    elif x.count("0") < n:
-        return "1"
-    return False
-
-# The binding function, which takes two RULES and returns the results of the one that does not return False
-@primitive
-def else_(r, r2):
-    if r != False:
-        return r
-    return r2
+    def likelihood(self, table):
+        key = table.tobytes()
+        if key not in self.memo:
 
-# a function to transform a pandas dataframe to a FunctionData object
-def dfToObj(dat):
-    return FunctionData(input=[dat.iloc[0]], output=dat.iloc[1], alpha=0.999)
+            # get the number of correct predictions by looking up the count of the rules output for every sequence
+            hits = self.counts[np.arange(len(SEQS)), table].sum()
+            self.memo[key] = hits * self.hit + (len(self) - hits) * self.miss
+        return self.memo[key]
 
-def LoTMod(tdata, top, h0, samp):
+class StudyCounts:
+    """
+    The data of all participants of a study sheet, reduced to the number of times each participant made each prediction for each sequence.
+    This allows the likelihoods of a whole block of rules for every participant to be computed with a matrix product of their truth tables
+    and the counts, using the same noise model as MyHypothesis.compute_single_likelihood.
+    """
+    def __init__(self, tdata, alpha=0.999):
+        self.participants = pd.unique(tdata['participant_id'])
+        col = pd.Index(self.participants).get_indexer(tdata['participant_id'])
+
+        # the number of trials of each participant, predictions that are not a bit are counted, but can never be correct
+        self.n = np.bincount(col, minlength=len(self.participants)).astype(float)
+
+        # count the predictions per bit, as a sequences by participants matrix
+        pred = tdata['prediction_raw'].astype(str).to_numpy()
+        seq = np.array([int(x, 2) for x in tdata['sequence']])
+        self.counts = np.zeros((2, len(SEQS), len(self.participants)))
+        for bit in (ZERO, ONE):
+            valid = pred == str(bit)
+            np.add.at(self.counts[bit], (seq[valid], col[valid]), 1)
+
+        self.hit = log((1.0-alpha)/100. + alpha)
+        self.miss = log((1.0-alpha)/100)
+
+    def likelihoods(self, tables, block=4096):
+        """
+        Compute the log likelihood of every rule (rows of tables) for every participant, the rules are processed in blocks to limit memory.
+        """
+        like = np.empty((len(tables), len(self.participants)))
+        for start in range(0, len(tables), block):
+            t = tables[start:start + block]
+
+            # the number of correct predictions is the sum over both bits of the sequences where the rule predicts that bit
+            hits = (t == ZERO).astype(float) @ self.counts[ZERO] + (t == ONE).astype(float) @ self.counts[ONE]
+            like[start:start + block] = hits * self.hit + (self.n - hits) * self.miss
+        return like
+
+class BehaviourTopN:
+    """
+    A version of the TopN of LOTlib3 that stores the best N hypotheses with a distinct behaviour, i.e. a distinct truth table, instead of the
+    best N distinct strings. Rules such as else_(conform_(x, 4), else_(conform_(x, 4), '1')) and else_(conform_(x, 4), '1') therefore take 
+    only one place. Of each behaviour the hypothesis with the highest posterior, which is the simplest form, is kept, while counting how 
+    many syntactically different forms of it were seen while it was stored. The forms of a behaviour that drops out are forgotten, so the
+    size of the TopN does not grow with the length of the chain.
+    """
+    def __init__(self, N=10):
+        self.N = N
+        self.best = {}
+        self.forms = {}
+
+    def add(self, h):
+        key = compileRule(str(h)).tobytes()
+
+        # replace the stored form if this one is better, or add the behaviour if it beats the worst stored behaviour
+        if key in self.best:
+            if h.posterior_score > self.best[key].posterior_score:
+                self.best[key] = h
+        elif len(self.best) < self.N:
+            self.best[key] = h
+        else:
+            worst = min(self.best, key=lambda k: self.best[k].posterior_score)
+            if h.posterior_score <= self.best[worst].posterior_score:
+                return
+            del self.best[worst]
+            self.forms.pop(worst, None)
+            self.best[key] = h
+        self.forms.setdefault(key, set()).add(str(h))
 
-    print("Processing participant: ", samp)
+    def __lshift__(self, h):
+        self.add(h)
 
-    # get the sequences and raw predictions for the current participant
-    p_data = tdata.loc[tdata['participant_id'] == samp, ['sequence', 'prediction_raw']]
+    def __len__(self):
+        return len(self.best)
 
-    # apply the transformation into data accepted by the LoT library
-    data = p_data.apply(dfToObj, axis = 1)
-            
-    # generate the top ten best strategies
-    for h in MetropolisHastingsSampler(h0, data, steps=500000):
-        top << h
+    def __contains__(self, h):
+        return compileRule(str(h)).tobytes() in self.best
 
+    def __iter__(self):
+        # go over the stored hypotheses from the highest to the lowest posterior
+        return iter(sorted(self.best.values(), key=lambda h: h.posterior_score, reverse=True))
+
+    def formCount(self, h):
+        # the number of different forms that were seen of the behaviour of h
+        return len(self.forms.get(compileRule(str(h)).tobytes(), ()))
+
+# a function to transform a pandas dataframe to a FunctionData object
+def dfToObj(dat):
+    return FunctionData(input=[dat.iloc[0]], output=dat.iloc[1], alpha=0.999)
+
+def checkLength(sequences):
+    # the fitting works with the truth tables of 8 outcomes, longer sequences can only be scored with Packed.PackedData
+    wrong = [x for x in pd.unique(pd.Series(sequences, dtype=str)) if len(x) != len(SEQS[0])]
+    if wrong:
+        raise ValueError("Only sequences of 8 outcomes can be fitted, got " + repr(wrong[0]))
+
+def encodeTrials(p_data):
+    """
+    Encode the trials of a participant as a compact array, with one row per trial holding the sequence as a number and the prediction as
+    ZERO or ONE, or as FALSE if it is not a bit. This is all a worker needs to fit a participant, and is much smaller to send to it than the
+    dataframe of the whole study.
+    """
+    checkLength(p_data['sequence'])
+    seq = [int(x, 2) for x in p_data['sequence']]
+    raw = p_data['prediction_raw'].astype(str)
+    pred = np.where(raw == '1', ONE, np.where(raw == '0', ZERO, FALSE))
+    return np.column_stack([seq, pred]).astype(np.uint8)
+
+def decodeTrials(trials):
+    # turn the encoded trials of a participant back into compiled data for the LoT library, a prediction that is not a bit becomes the
+    # string of a missing prediction, which no rule outputs, so like in StudyCounts it is never correct
+    return CompiledData([FunctionData(input=[SEQS[seq]], output=str(pred) if pred <= ONE else 'nan', alpha=0.999) for seq, pred in trials])
+
+def participantFile(ckpt, samp, ext):
+    # the path of the checkpoint (.pkl) or finished results (.csv) of a participant
+    return os.path.join(ckpt, 'p' + str(samp) + ext)
+
+def saveCheckpoint(path, state):
+    """
+    Write the state of a chain to path, first to a temporary file that then replaces the old checkpoint, so that a job that gets stopped 
+    while writing never leaves a broken checkpoint behind.
+    """
+    with open(path + '.tmp', 'wb') as f:
+        pickle.dump(state, f)
+    os.replace(path + '.tmp', path)
+
+def loadCheckpoint(path):
+    # return the stored state of a chain, or None if it has no checkpoint yet
+    if not os.path.exists(path):
+        return None
+    with open(path, 'rb') as f:
+        return pickle.load(f)
+
+def topToDf(top, samp):
+    """
+    Extract the hypotheses in the topN of a participant into a dataframe.
+    """
     # intialize lists, to extract topN hypothesis data from
     prior = []
     like = []
     post = []
     rule = []
+    forms = []
 
     # extract the data
     for h in top:
@@ -151,60 +216,324 @@ def LoTMod(tdata, top, h0, samp):
         post.append(h.posterior_score)
         like.append(h.likelihood)
         rule.append(qq(h))
+        forms.append(top.formCount(h))
 
-    # create a dataframe to concat to the final data
-    mvData = pd.DataFrame({'p_id' : samp, 'posterior' : post, 'prior' : prior, 'likelihood' : like, 'rule' : rule})
+    return pd.DataFrame({'p_id' : samp, 'posterior' : post, 'prior' : prior, 'likelihood' : like, 'rule' : rule, 'forms' : forms})
+
+def LoTMod(trials, top, h0, samp, ckpt=None, steps=500000, every=10000, metrics=None, profile=None):
+    """
+    Run the Metropolis-Hastings sampler on the trials of a participant (see encodeTrials) and return the top hypotheses. If a checkpoint directory (ckpt) is 
+    given, the current hypothesis, topN and step count are stored every so many steps, and a chain with a checkpoint continues where it 
+    was. As the chain is a Markov chain, the current hypothesis is all that is needed to continue it. The finished results are written to
+    the checkpoint directory as well. The metrics of the sampler are appended to the file metrics if given (see ChainMonitor), and the
+    sampler is profiled into the directory profile if given.
+    """
+    with profiled(profile, samp):
+        return sampleParticipant(trials, top, h0, samp, ckpt, steps, every, metrics)
 
+def sampleParticipant(trials, top, h0, samp, ckpt, steps, every, metrics):
+    # the body of LoTMod, which is kept apart so it can be profiled as a whole
+    print("Processing participant: ", samp)
+
+    # transform the trials into data accepted by the LoT library, compiled for the truth table likelihood
+    data = decodeTrials(trials)
+
+    # continue from the checkpoint of the participant if there is one
+    done = 0
+    state = loadCheckpoint(participantFile(ckpt, samp, '.pkl')) if ckpt else None
+    if state:
+        h0, top, done = state['current'], state['top'], state['step']
+        print("Resuming participant: ", samp, "at step", done)
+
+    # generate the top ten best strategies, while keeping the metrics of the sampler
+    monitor = ChainMonitor(samp, data, metrics, total=steps, every=every)
+    h = h0
+    for h in monitor.watch(MetropolisHastingsSampler(h0, data, steps=steps - done), done):
+        top << h
+        done += 1
+
+        # periodically store the state of the chain
+        if ckpt and done % every == 0:
+            saveCheckpoint(participantFile(ckpt, samp, '.pkl'), {'current' : h, 'top' : top, 'step' : done})
+
+    # create a dataframe to concat to the final data
+    mvData = topToDf(top, samp)
+
+    # write the finished participant, after which the checkpoint of the chain is no longer needed, only the final state is kept so the
+    # chain can be warm started when the participant gets new trials (see refitStudy)
+    if ckpt:
+        mvData.to_csv(participantFile(ckpt, samp, '.csv'), index=False)
+        saveCheckpoint(participantFile(ckpt, samp, '.state.pkl'), {'current' : h, 'top' : top})
+        if os.path.exists(participantFile(ckpt, samp, '.pkl')):
+            os.remove(participantFile(ckpt, samp, '.pkl'))
+
+    record = monitor.finish()
+    print("Finished participant: ", samp, "steps/sec: ", round(record['steps_per_sec'], 1), "acceptance: ", round(record['acceptance'], 3))
     return mvData
 
-grammar = Grammar(start='START')
+def timedTask(fn, *args):
+    # run a task and return its result, together with the worker process that ran it and when
+    start = time.time()
+    result = fn(*args)
+    return result, os.getpid(), start, time.time()
+
+def dispatch(fn, tasks, workers):
+    """
+    Run fn on every task (a tuple of arguments) in parallel, in the given order, and return the results in the same order. It prints the 
+    number of bytes that are sent to the workers, and how long each worker was busy and idle during the run.
+    """
+    sent = [len(pickle.dumps(args)) for args in tasks]
+    print("Serialized bytes: ", sum(sent), "per task: ", sum(sent) / max(len(sent), 1))
+
+    start = time.time()
+    output = Parallel(n_jobs=workers, backend='multiprocessing')(delayed(timedTask)(fn, *args) for args in tasks)
+    total = time.time() - start
+
+    # sum the time each worker spent on tasks, the rest of the run it was idle
+    busy = {}
+    for _, pid, s, e in output:
+        busy[pid] = busy.get(pid, 0) + e - s
+    for pid, b in busy.items():
+        print("Worker ", pid, "busy: ", round(b, 2), "idle: ", round(total - b, 2))
+
+    return [result for result, _, _, _ in output]
 
-# Create the start conditions where they can either opt for an end-rule, or combination logic
-grammar.add_rule('START', '', ['PRE_END'], 1.0)
-grammar.add_rule('START', '', ['COMB'], 1.0)
+def numWorkers(workers=None):
+    # the number of workers, given on the command line, or else the number of cpus of the SLURM job, or else all cpus of this machine
+    if workers:
+        return workers
+    return int(os.environ.get('SLURM_CPUS_PER_TASK', os.cpu_count()))
 
-# rule to add recursion to the finding algorithm
-grammar.add_rule('COMB', 'else_', ['PRERULE', 'COMB'], 1.0)
+def gelmanRubin(traces):
+    """
+    Compute the R-hat statistic of Gelman & Rubin over the second half of the posterior traces of several chains. Values close to 1 mean 
+    that the chains agree with each other, chains that are all stuck on the same posterior also count as agreeing.
+    """
+    n = min(len(t) for t in traces) // 2
+    if n < 2:
+        return np.inf
+    x = np.array([t[-n:] for t in traces])
+
+    # the mean variance within the chains, and the variance between the chain means
+    W = x.var(axis=1, ddof=1).mean()
+    B = n * x.mean(axis=1).var(ddof=1)
+    if W == 0:
+        return 1.0 if B == 0 else np.inf
+    return np.sqrt(((n - 1) / n * W + B / n) / W)
+
+def LoTModAdaptive(trials, top, h0, samp, chains=4, block=5000, patience=20000, maxRhat=1.1, cap=500000, metrics=None, profile=None):
+    """
+    A version of LoTMod that stops once the participant has converged, instead of always taking the full number of steps. Several chains
+    are run in turns of a block of steps, all feeding the same topN. The participant has converged when the topN did not get a new 
+    behaviour for patience steps and the R-hat of the posterior traces of the chains is below maxRhat. The total number of steps over all 
+    chains never exceeds the cap. Returns the topN dataframe and a single row report of the steps used. The metrics and profile are the
+    same as in LoTMod, with the steps of all chains counted together.
+    """
+    with profiled(profile, samp):
+        return adaptParticipant(trials, top, h0, samp, chains, block, patience, maxRhat, cap, metrics)
+
+def adaptParticipant(trials, top, h0, samp, chains, block, patience, maxRhat, cap, metrics):
+    # the body of LoTModAdaptive, which is kept apart so it can be profiled as a whole
+    print("Processing participant: ", samp)
+
+    # transform the trials into data accepted by the LoT library, compiled for the truth table likelihood
+    data = decodeTrials(trials)
 
-# add the ending condition, so that every strategies which result in a direct answer only get situated at the end of a rule
-grammar.add_rule('COMB', 'else_', ['PRERULE', 'PRE_END'], 1.0)
+    # create the chains, which all start at h0, and keep track of their posterior traces and the metrics of the sampler
+    monitor = ChainMonitor(samp, data, metrics, total=cap, every=block)
+    samplers = [monitor.watch(MetropolisHastingsSampler(h0, data, steps=cap // chains)) for _ in range(chains)]
+    traces = [[] for _ in range(chains)]
 
-# add the pre-rules, so that negation is possible e.g., flipping the last bit, or simply place a bit at the end
-grammar.add_rule('PRE_END', '', ['BIT'], 1.0)
-grammar.add_rule('PRE_END', '', ['RULEL'], 1.0)
-grammar.add_rule('PRE_END', 'invert_', ['RULEL'], 1.0)
-grammar.add_rule('PRERULE', '', ['RULE'], 1.0)
-grammar.add_rule('PRERULE', 'invert_', ['RULE'], 1.0)
+    steps = 0
+    stable = 0
+    rhat = np.inf
+    converged = False
 
-# add rules for people who simply answer a bit, or as a last resort
-grammar.add_rule('BIT', "'1'", None, 1.0)
-grammar.add_rule('BIT', "'0'", None, 1.0)
+    while not converged:
+        before = set(top.best)
 
-# add rules to infer index for a rule
-grammar.add_rule('INDEX', '0', None, 1.0)
-grammar.add_rule('INDEX', '7', None, 1.0)
+        # advance every chain by a block of steps
+        for c, sampler in enumerate(samplers):
+            for h in islice(sampler, block):
+                top << h
+                traces[c].append(h.posterior_score)
+                steps += 1
 
-# add rules to find streak length   
-for n in range(7):
-    grammar.add_rule('STREAKL', str(n), None, 1.0)
+        # stop at the cap, which is reached when the chains have no steps left
+        if all(len(t) >= cap // chains for t in traces):
+            break
 
-# add rules to find best number of similar outcomes that induces balancing or conforming
-for n in range(1, 5):
-    grammar.add_rule('FREQ', str(n), None, 1.0)
+        # count the steps without a change in the behaviours of the topN, and check whether the chains agree
+        stable = stable + block * chains if set(top.best) == before else 0
+        rhat = gelmanRubin(traces)
+        converged = stable >= patience and rhat <= maxRhat
 
-# add the strategy rules
-grammar.add_rule('RULEL', 'get_', ['x', 'INDEX'], 1.0)
-grammar.add_rule('RULE', 'streak_', ['x', 'STREAKL'], 1.0)
-grammar.add_rule('RULE', 'balance_', ['x', 'FREQ'], 1.0)
-grammar.add_rule('RULE', 'conform_', ['x', 'FREQ'], 1.0)
-grammar.add_rule('RULE', 'patternCont_', ['x'], 1.0)
+    monitor.finish()
+    report = pd.DataFrame({'p_id' : [samp], 'steps' : [steps], 'rhat' : [rhat], 'converged' : [converged]})
+    return topToDf(top, samp), report
+
+def LoTEnum(tdata, space, N=10):
+    """
+    The exhaustive alternative to LoTMod, which scores every rule in the enumerated space (see enumerateRules) on the data of all 
+    participants at once, and returns the exact top N rules of every participant in the same format as LoTMod.
+    """
+    study = StudyCounts(tdata)
+
+    # get the posterior of every rule for every participant, with rules as rows and participants as columns
+    like = study.likelihoods(space.tables)
+    post = space.prior[:, None] + like
+
+    # get the best N rules of each participant, on a tie the simpler rule comes first
+    best = np.argsort(-post, axis=0, kind='stable')[:N]
+
+    results = []
+    for j, samp in enumerate(study.participants):
+        results.append(pd.DataFrame({'p_id' : samp, 'posterior' : post[best[:, j], j], 'prior' : space.prior[best[:, j]], 
+                                     'likelihood' : like[best[:, j], j], 'rule' : [qq('lambda x: ' + space.rules[i]) for i in best[:, j]]}))
+    return results
+
+def LoTPopulation(tdata, h0, steps=20000, temps=(1.0, 2.0, 4.0), swap=10, N=10):
+    """
+    A population version of LoTMod, that samples all participants of the study together. Every participant has a chain at each temperature
+    in temps, and every proposal of any chain is scored once against all participants, by adding its behaviour to a shared pool with the
+    likelihood of every participant. Every swap steps, neighbouring temperatures of a participant exchange their hypotheses (parallel 
+    tempering), and the coldest chains of random pairs of participants exchange theirs, so a good rule found for one participant quickly 
+    reaches the others. Returns the top N behaviours of the pool for every participant, in the same format as LoTMod.
+    """
+    study = StudyCounts(tdata)
+    P = len(study.participants)
+    temps = np.asarray(temps, dtype=float)
+
+    # the pool of every proposed behaviour: its simplest hypothesis, its prior, its likelihood for every participant and its forms
+    pool = {}
+    def score(h):
+        # the rule is compiled once, its table is both the key of its behaviour and what is scored when the behaviour is new
+        rule = str(h)
+        table = compileRule(rule)
+        key = table.tobytes()
+        if key not in pool:
+            pool[key] = {'h' : h, 'prior' : h.prior, 'like' : study.likelihoods(table[None, :])[0], 'forms' : set()}
+        entry = pool[key]
+        entry['forms'].add(rule)
+        if h.prior > entry['prior']:
+            entry['h'], entry['prior'] = h, h.prior
+        return entry['like']
+
+    # every chain starts at h0, the state of a chain is its hypothesis and the likelihood of its hypothesis for all participants
+    h0.compute_prior()
+    current = [[h0] * P for _ in temps]
+    likes = [[score(h0)] * P for _ in temps]
+
+    for step in range(1, steps + 1):
+
+        # a Metropolis-Hastings step for every chain, as in MetropolisHastingsSampler but scored with the pool
+        for t, temp in enumerate(temps):
+            for p in range(P):
+                h = current[t][p]
+                prop, fb = h.propose()
+                prop.compute_prior()
+                like = score(prop)
+                r = (prop.prior + like[p] / temp) - (h.prior + likes[t][p][p] / temp) - fb
+                if r >= 0 or np.random.random() < np.exp(r):
+                    current[t][p], likes[t][p] = prop, like
+
+        if step % swap:
+            continue
+
+        # exchange the hypotheses of neighbouring temperatures of every participant
+        for t in range(len(temps) - 1):
+            for p in range(P):
+                r = (likes[t + 1][p][p] - likes[t][p][p]) * (1 / temps[t] - 1 / temps[t + 1])
+                if r >= 0 or np.random.random() < np.exp(r):
+                    current[t][p], current[t + 1][p] = current[t + 1][p], current[t][p]
+                    likes[t][p], likes[t + 1][p] = likes[t + 1][p], likes[t][p]
+
+        # exchange the hypotheses of the coldest chains of random pairs of participants, the priors cancel out
+        order = np.random.permutation(P)
+        for p, q in zip(order[0::2], order[1::2]):
+            r = likes[0][q][p] + likes[0][p][q] - likes[0][p][p] - likes[0][q][q]
+            if r >= 0 or np.random.random() < np.exp(r):
+                current[0][p], current[0][q] = current[0][q], current[0][p]
+                likes[0][p], likes[0][q] = likes[0][q], likes[0][p]
+
+        if step % (swap * 100) == 0:
+            print("Step: ", step, "behaviours in pool: ", len(pool))
+
+    # get the posterior of every behaviour in the pool for every participant, and the best N of each participant as in LoTEnum
+    entries = list(pool.values())
+    prior = np.array([e['prior'] for e in entries])
+    like = np.array([e['like'] for e in entries])
+    post = prior[:, None] + like
+    best = np.argsort(-post, axis=0, kind='stable')[:N]
+
+    results = []
+    for j, samp in enumerate(study.participants):
+        results.append(pd.DataFrame({'p_id' : samp, 'posterior' : post[best[:, j], j], 'prior' : prior[best[:, j]], 
+                                     'likelihood' : like[best[:, j], j], 'rule' : [qq(entries[i]['h']) for i in best[:, j]],
+                                     'forms' : [len(entries[i]['forms']) for i in best[:, j]]}))
+    return results
+
+@lru_cache(maxsize=None)
+def makeGrammar(length=8):
+    """
+    Build the grammar for sequences of the given length. The indices, streak lengths and frequencies the rules can use grow with the
+    length, for 8 outcomes this is the grammar of the original model. Longer sequences are evaluated with the bit packed primitives of
+    Packed.py, as their truth tables would be too large.
+    """
+    grammar = Grammar(start='START')
+
+    # Create the start conditions where they can either opt for an end-rule, or combination logic
+    grammar.add_rule('START', '', ['PRE_END'], 1.0)
+    grammar.add_rule('START', '', ['COMB'], 1.0)
+
+    # rule to add recursion to the finding algorithm
+    grammar.add_rule('COMB', 'else_', ['PRERULE', 'COMB'], 1.0)
+
+    # add the ending condition, so that every strategies which result in a direct answer only get situated at the end of a rule
+    grammar.add_rule('COMB', 'else_', ['PRERULE', 'PRE_END'], 1.0)
+
+    # add the pre-rules, so that negation is possible e.g., flipping the last bit, or simply place a bit at the end
+    grammar.add_rule('PRE_END', '', ['BIT'], 1.0)
+    grammar.add_rule('PRE_END', '', ['RULEL'], 1.0)
+    grammar.add_rule('PRE_END', 'invert_', ['RULEL'], 1.0)
+    grammar.add_rule('PRERULE', '', ['RULE'], 1.0)
+    grammar.add_rule('PRERULE', 'invert_', ['RULE'], 1.0)
+
+    # add rules for people who simply answer a bit, or as a last resort
+    grammar.add_rule('BIT', "'1'", None, 1.0)
+    grammar.add_rule('BIT', "'0'", None, 1.0)
+
+    # add rules to infer index for a rule
+    grammar.add_rule('INDEX', '0', None, 1.0)
+    grammar.add_rule('INDEX', str(length - 1), None, 1.0)
+
+    # add rules to find streak length
+    for n in range(length - 1):
+        grammar.add_rule('STREAKL', str(n), None, 1.0)
+
+    # add rules to find best number of similar outcomes that induces balancing or conforming
+    for n in range(1, length // 2 + 1):
+        grammar.add_rule('FREQ', str(n), None, 1.0)
+
+    # add the strategy rules
+    grammar.add_rule('RULEL', 'get_', ['x', 'INDEX'], 1.0)
+    grammar.add_rule('RULE', 'streak_', ['x', 'STREAKL'], 1.0)
+    grammar.add_rule('RULE', 'balance_', ['x', 'FREQ'], 1.0)
+    grammar.add_rule('RULE', 'conform_', ['x', 'FREQ'], 1.0)
+    grammar.add_rule('RULE', 'patternCont_', ['x'], 1.0)
+
+    return grammar
+
+# the grammar of the model, for sequences of 8 outcomes
+grammar = makeGrammar()
 
 # create the hypothesis which will create a rule that fit an individual input-output set.
 class MyHypothesis(LOTHypothesis):
     def __init__(self, **kwargs):
             
-        # note that our grammar defined above is passed to MyHypothesis here
-        LOTHypothesis.__init__(self, grammar=grammar, **kwargs)
+        # note that our grammar defined above is passed to MyHypothesis here, unless the grammar of another length is given
+        kwargs.setdefault('grammar', grammar)
+        LOTHypothesis.__init__(self, **kwargs)
             
     # Question 2: This likelihood function works, but is definitily not accurate in terms of actual probabilities yet.
     def compute_single_likelihood(self, data):
@@ -213,32 +542,365 @@ class MyHypothesis(LOTHypothesis):
         else:
             return log((1.0-data.alpha)/100)
 
-if __name__ == '__main__':
+    def compute_likelihood(self, data, **kwargs):
+        """
+        Compute the likelihood with the truth table of the rule if the data is compiled, which gives the same result as summing
+        compute_single_likelihood over all the data. Data of longer sequences (Packed.PackedData) scores the rule with the bit packed
+        primitives instead. Other data falls back to the per datum likelihood of LOTlib3.
+        """
+        if not isinstance(data, CompiledData) and not hasattr(data, 'ruleLikelihood'):
+            return LOTHypothesis.compute_likelihood(self, data, **kwargs)
+
+        start = time.perf_counter()
+        if isinstance(data, CompiledData):
+            self.likelihood = data.likelihood(compileRule(str(self))) / self.likelihood_temperature
+        else:
+            self.likelihood = data.ruleLikelihood(str(self)) / self.likelihood_temperature
+        data.seconds += time.perf_counter() - start
+        self.update_posterior()
+        return self.likelihood
+
+def stringRule(rule):
+    """
+    Turn a rule into a function of a single sequence that calls the string primitives, in the same way as a hypothesis of LOTlib3 does, so
+    a stored rule can be checked against its truth table without LOTlib3 building the hypothesis.
+    """
+    tree = parseRule(rule)
+    def call(node, x):
+        if node[0] == 'x':
+            return x
+        if node[0] in ('int', 'bit'):
+            return node[1]
+        return STRING_PRIMITIVES[node[0]](*[call(arg, x) for arg in node[1]])
+    return lambda x: call(tree, x)
+
+def verifyCompiled(h, data):
+    """
+    Check that the compiled version of hypothesis h is the same as the original, both its output on every sequence and its likelihood 
+    on the given data, up to floating point rounding. h can also be a rule string, which is then called with the string primitives.
+    """
+    rule, h = (h, stringRule(h)) if isinstance(h, str) else (str(h), h)
+    table = compileRule(rule)
+    sameOutput = all(table[i] == encodeOut(h(s)) for i, s in enumerate(SEQS))
+    slow = sum(MyHypothesis.compute_single_likelihood(h, datum) for datum in data)
+    fast = CompiledData(data).likelihood(table)
+    return sameOutput and isclose(slow, fast, rel_tol=1e-12)
+
+def verifyStudy(experiment, data=DATA):
+    """
+    Check the compiled likelihood against the per datum likelihood (see verifyCompiled) for every stored rule of every participant of a
+    study (LoT<experiment> in the data folder), on the trials of that participant. Returns the participants and rules that differ.
+    """
+    from Results import loadResults
+    facts, rules = loadResults(os.path.join(data, 'LoT' + experiment))
+    trials = {p : decodeTrials(encodeTrials(g)) for p, g in loadStudy(experiment).groupby('participant_id')}
+    stored = zip(facts['p_id'], rules['rule'].to_numpy()[facts['rule_id'].to_numpy()])
+    return [(p, rule) for p, rule in stored if p in trials and not verifyCompiled(rule, trials[p])]
+
+class RuleSpace:
+    """
+    A collection of rules from the grammar, stored as their log prior, expression and truth table (one row per rule). Nonterminals that
+    produce the argument of a primitive, such as INDEX, store a list with the argument values in place of the truth tables.
+    """
+    def __init__(self, prior, rules, tables):
+        self.prior = np.asarray(prior, dtype=float)
+        self.rules = list(rules)
+        self.tables = tables
+
+    def __len__(self):
+        return len(self.rules)
+
+    def unique(self):
+        """
+        Keep only the rule with the highest prior for every distinct truth table, on a tie the first rule is kept.
+        """
+        order = np.argsort(-self.prior, kind='stable')
+        rows = np.ascontiguousarray(self.tables[order]).view(np.dtype((np.void, len(SEQS)))).ravel()
+        _, first = np.unique(rows, return_index=True)
+        keep = order[np.sort(first)]
+        return RuleSpace(self.prior[keep], [self.rules[i] for i in keep], self.tables[keep])
+
+def applyRule(name, lp, children):
+    """
+    Apply a primitive to every combination of its enumerated arguments, where lp is the log probability of the grammar rule itself. When
+    the last argument is a set of rules, the primitive is applied to all of its truth tables at once.
+    """
+    fn = TABLE_PRIMITIVES[name] if name else (lambda r: r)
+    *heads, last = children
+    prior, rules, tables = [], [], []
+
+    for combo in product(*[range(len(c)) for c in heads]):
+        args = [c.tables[i] for c, i in zip(heads, combo)]
+        exprs = [c.rules[i] for c, i in zip(heads, combo)]
+        hp = lp + sum(c.prior[i] for c, i in zip(heads, combo))
+
+        # the last argument is either a set of rules, which are handled together, or a list of argument values
+        if isinstance(last.tables, np.ndarray):
+            tables.append(fn(*args, last.tables))
+            prior.append(hp + last.prior)
+            rules += [name + '(' + ', '.join(exprs + [e]) + ')' if name else e for e in last.rules]
+        else:
+            for j in range(len(last)):
+                tables.append(asTable(fn(*args, last.tables[j]))[None, :])
+                prior.append([hp + last.prior[j]])
+                rules.append(name + '(' + ', '.join(exprs + [last.rules[j]]) + ')' if name else last.rules[j])
 
-    # get the relevant experiment
-    experiment = sys.argv[1]
+    if not tables:
+        return RuleSpace([], [], np.zeros((0, len(SEQS)), dtype=np.int8))
+    return RuleSpace(np.concatenate(prior), rules, np.concatenate(tables).astype(np.int8))
 
-    # Load in the whole Excel file
-    all_data = pd.ExcelFile("/gpfs/home6/cfermin/SnelLoTThesis/Data/PredictingOutcomes_ParticipantPredictions.xlsx")
+def expandRules(nt, depth, memo):
+    """
+    Enumerate every distinct rule that nonterminal nt of the grammar can produce with at most depth else_ links, together with its log prior.
+    Only the rule with the highest prior is kept for each truth table, which keeps the number of rules small even for deep chains.
+    """
+    if (nt, depth) in memo:
+        return memo[(nt, depth)]
+
+    total = sum(r.p for r in grammar.rules[nt])
+    parts = []
+
+    for r in grammar.rules[nt]:
+        lp = log(r.p / total)
+
+        # a terminal is either a bit, which is a rule on its own, or the argument of a primitive such as an index
+        if r.to is None:
+            value = eval(r.name)
+            parts.append(RuleSpace([lp], [r.name], asTable(value)[None, :] if isinstance(value, str) else [value]))
+            continue
+
+        # every else_ adds a link to the chain, which is only possible if the maximum depth is not yet reached
+        sub = depth
+        if r.name == 'else_':
+            if depth == 0:
+                continue
+            sub = depth - 1
+
+        children = [expandRules(a, sub, memo) if a in grammar.rules else RuleSpace([0.0], [a], [None]) for a in r.to]
+        parts.append(applyRule(r.name, lp, children))
+
+    # combine the options of all grammar rules, only deduplicating nonterminals that produce rules
+    if parts and isinstance(parts[0].tables, np.ndarray):
+        space = RuleSpace(np.concatenate([p.prior for p in parts]), [e for p in parts for e in p.rules], 
+                          np.concatenate([p.tables for p in parts])).unique()
+    else:
+        space = RuleSpace([lp for p in parts for lp in p.prior], [e for p in parts for e in p.rules], [v for p in parts for v in p.tables])
+
+    memo[(nt, depth)] = space
+    return space
+
+def enumerateRules(depth=4):
+    """
+    Enumerate all behaviourally distinct rules of the grammar with at most depth else_ links, each represented by its simplest expression.
+    """
+    return expandRules(grammar.start, depth, {})
 
-    # extract the worksheet of study 1B, and ensure the type of the sequence and prediction is a string
-    data = pd.read_excel(all_data, 'Study ' + experiment, dtype={"sequence": str, "prediction_raw": str})
-    
-    # creat the hypothesis and initilize the topN results storage
-    tn = TopN(N=10)
+# the ways fitStudy can find the rules of the participants
+MODES = ['mcmc', 'adaptive', 'enum', 'population']
+
+def fitStudy(data, mode='mcmc', depth=4, workers=None, ckpt=None, stepsPath=None, metrics=None, profile=None):
+    """
+    Find the best rules of every participant in the sheet of a study, either by sampling (mcmc), sampling until converged (adaptive),
+    exhaustive enumeration up to a depth (enum) or sampling all participants together (population). Sampling uses the checkpoint directory ckpt if given, and the adaptive mode stores the
+    steps each participant took at stepsPath if given. The metrics of the samplers are appended to the file metrics, and every participant
+    is profiled into the directory profile, if given (see Monitor.py). Returns the topN rules of all participants in a single dataframe.
+    """
+    checkLength(data['sequence'])
+
+    # creat the starting hypothesis, every task gets its own topN results storage
     h0 = MyHypothesis()
+    workers = numWorkers(workers)
     
     # get all the participants
     participants = pd.unique(data['participant_id'])
 
-    # run the LoT model in parralel
-    results = Parallel(n_jobs=64, backend='multiprocessing')(
-        delayed(LoTMod)(data, tn, h0, p) for p in participants
-    )
+    # group the sheet once into the encoded trials of every participant, and order the participants with the most trials first
+    trials = {p : encodeTrials(g) for p, g in data.groupby('participant_id', sort=False)}
+    longest = sorted(participants, key=lambda p: -len(trials[p]))
+
+    # enumerate the rules once and score every participant against them, which is fast enough to not need parallelization
+    if mode == 'enum':
+        space = enumerateRules(depth)
+        print("Distinct rules: ", len(space))
+        results = LoTEnum(data, space)
+
+    # sample all participants together, sharing every proposal between them
+    elif mode == 'population':
+        results = LoTPopulation(data, h0)
+
+    # run the LoT model in parallel, but stop each participant when it has converged, and save how many steps each participant took
+    elif mode == 'adaptive':
+        output = dict(zip(longest, dispatch(partial(LoTModAdaptive, metrics=metrics, profile=profile),
+                                                              [(trials[p], BehaviourTopN(N=10), h0, p) for p in longest], workers)))
+        results = [output[p][0] for p in participants]
+        steps = pd.concat([output[p][1] for p in participants], ignore_index=True)
+        print("Total steps: ", steps['steps'].sum(), "converged: ", steps['converged'].mean())
+        if stepsPath:
+            steps.to_csv(stepsPath, index=False)
+
+    # run the LoT model in parralel, skipping the participants that were finished by an earlier run of the job
+    else:
+        if ckpt:
+            os.makedirs(ckpt, exist_ok=True)
+        todo = [p for p in longest if not (ckpt and os.path.exists(participantFile(ckpt, p, '.csv')))]
+        print("Participants left: ", len(todo), "of", len(participants))
+
+        output = dict(zip(todo, dispatch(partial(LoTMod, metrics=metrics, profile=profile), 
+                                             [(trials[p], BehaviourTopN(N=10), h0, p, ckpt) for p in todo], workers)))
+
+        # the participants that were finished by an earlier run are read back in, as they were written when finished
+        results = [output[p] if p in output else pd.read_csv(participantFile(ckpt, p, '.csv')) for p in participants]
 
     # concattenate the list in results containing small individual dataframes.
-    LoTData = pd.concat(results, ignore_index=True)
+    return pd.concat(results, ignore_index=True)
+
+def checkpointDir(experiment):
+    # the checkpoint directory of the sampler of a study, which refitStudy warm starts the chains of changed participants from
+    return "/gpfs/home6/cfermin/SnelLoTThesis/Data/LoT" + experiment + "_checkpoints"
+
+def changedTrials(data, seen):
+    """
+    Find the participants of the study sheet whose trials differ from the trials they were fitted on (seen, with the p_id, seq_id and p_pred
+    of every trial, as in the stored best rules). The trials are compared as encoded by encodeTrials regardless of their order, with a
+    prediction that is not a bit counted as 0 like the p_pred of the stored best rules. Participants without stored trials count as changed.
+    """
+    stored = {p : np.sort(g['seq_id'].to_numpy().astype(np.int64) * 2 + g['p_pred'].to_numpy()) for p, g in seen.groupby('p_id')}
+    changed = []
+    for p, g in data.groupby('participant_id', sort=False):
+        trials = encodeTrials(g).astype(np.int64)
+        if p not in stored or not np.array_equal(np.sort(trials[:, 0] * 2 + (trials[:, 1] == ONE)), stored[p]):
+            changed.append(p)
+    return changed
+
+def rescoreTop(facts, rules, data):
+    """
+    Score the stored topN rules (facts, with rule ids into the dictionary rules) of every participant that is still in the study sheet on
+    their current trials. Returns the rescored topN in the same format as LoTMod.
+    """
+    facts = facts[facts['p_id'].isin(data['participant_id'])]
+    study = StudyCounts(data[data['participant_id'].isin(facts['p_id'])])
+
+    # the likelihood of every stored rule for every participant, of which only the rules of the participant itself are used
+    ids, rows = np.unique(facts['rule_id'].to_numpy(), return_inverse=True)
+    tables = np.array([compileRule(r) for r in rules['rule'].to_numpy()[ids]]).reshape(-1, len(SEQS))
+    like = study.likelihoods(tables)[rows, pd.Index(study.participants).get_indexer(facts['p_id'])]
+
+    prior = rules['prior'].to_numpy()[facts['rule_id'].to_numpy()]
+    rescored = pd.DataFrame({'p_id' : facts['p_id'].to_numpy(), 'posterior' : prior + like, 'prior' : prior, 'likelihood' : like,
+                             'rule' : rules['rule'].to_numpy()[facts['rule_id'].to_numpy()]})
+    if 'forms' in facts.columns:
+        rescored['forms'] = facts['forms'].to_numpy()
+
+    return rescored
+
+def mergeTop(frames, N=10):
+    """
+    Merge topN dataframes of the same participants, keeping the best N distinct behaviours of every participant, and for every behaviour the
+    form with the highest posterior.
+    """
+    merged = pd.concat(frames, ignore_index=True)
+    merged['behaviour'] = [compileRule(r).tobytes() for r in merged['rule']]
+    merged = merged.sort_values('posterior', ascending=False, kind='stable').drop_duplicates(['p_id', 'behaviour'])
+    return merged.groupby('p_id', sort=False).head(N).drop(columns='behaviour').sort_values(['p_id', 'posterior'], 
+                                                                                             ascending=[True, False], kind='stable')
 
-    # save the data in csv
-    LoTData.to_csv("/gpfs/home6/cfermin/SnelLoTThesis/Data/LoT" + experiment + ".csv", index=False)
+def refitStudy(data, facts, rules, seen, mode='mcmc', depth=4, workers=None, ckpt=None, steps=50000):
+    """
+    Update the stored results of the LoT model (facts and rules, see Results.normalize) after the study sheet got new participants or new
+    trials. The trials the participants were fitted on (seen, see changedTrials) tell which participants changed. New participants are
+    fitted as in fitStudy. The stored topN of a participant whose trials changed is rescored on the new trials, and is then improved by a
+    shorter chain of steps, which is warm started from the final state of its chain in the checkpoint directory if it is there (the
+    rescored topN and best hypothesis), and otherwise from h0. The new final states are written to the checkpoint directory, so the next
+    refit can warm start from them. With exhaustive enumeration the changed participants are simply enumerated again. Returns the topN of
+    all participants, as fitStudy, and the participants that were fitted again.
+    """
+    checkLength(data['sequence'])
+    rescored = rescoreTop(facts, rules, data)
+    old = data[data['participant_id'].isin(facts['p_id'])]
+    changed = changedTrials(old, seen)
+    new = [p for p in pd.unique(data['participant_id']) if p not in set(facts['p_id'])]
+    affected = list(changed) + new
+    print("New participants: ", len(new), "changed participants: ", len(changed))
+
+    fitted = []
+    if new:
+        fitted.append(fitStudy(data[data['participant_id'].isin(new)], mode, depth, workers, ckpt))
+
+    if len(changed):
+        subset = data[data['participant_id'].isin(changed)]
+        if mode != 'mcmc':
+            fitted.append(fitStudy(subset, mode, depth, workers))
+
+            # the new results of the changed participants are written to the checkpoint directory as well
+            if ckpt:
+                os.makedirs(ckpt, exist_ok=True)
+                for p, g in fitted[-1].groupby('p_id'):
+                    g.to_csv(participantFile(ckpt, p, '.csv'), index=False)
+        else:
+            trials = {p : encodeTrials(g) for p, g in subset.groupby('participant_id', sort=False)}
+            tasks = []
+            for p in changed:
+
+                # rescore the final state of the chain on the new trials, and continue from the best hypothesis
+                state = loadCheckpoint(participantFile(ckpt, p, '.state.pkl')) if ckpt else None
+                top, h0 = BehaviourTopN(N=10), MyHypothesis()
+                if state:
+                    compiled = decodeTrials(trials[p])
+                    for h in state['top']:
+                        h.compute_likelihood(compiled)
+                        top << h
+                    h0 = max(top, key=lambda h: h.posterior_score)
+
+                # an unfinished chain in the checkpoint directory may have run on other trials, so it starts again from the final state
+                if ckpt and os.path.exists(participantFile(ckpt, p, '.pkl')):
+                    os.remove(participantFile(ckpt, p, '.pkl'))
+                tasks.append((trials[p], top, h0, p, ckpt, steps))
+
+            # LoTMod writes the new results and final state of every changed participant to the checkpoint directory
+            if ckpt:
+                os.makedirs(ckpt, exist_ok=True)
+            fitted.append(pd.concat(dispatch(LoTMod, tasks, numWorkers(workers)), ignore_index=True))
+
+    # the unaffected participants keep their stored topN, the affected ones get the best of their rescored and new topN
+    keep = rescored[~rescored['p_id'].isin(affected)]
+    update = mergeTop([rescored[rescored['p_id'].isin(changed)]] + fitted)
+    order = pd.Index(pd.unique(data['participant_id']))
+    LoTData = pd.concat([keep, update], ignore_index=True)
+    LoTData = LoTData.iloc[np.argsort(order.get_indexer(LoTData['p_id']), kind='stable')].reset_index(drop=True)
+    return LoTData, affected
+
+if __name__ == '__main__':
 
+    # get the relevant experiment, and the mode which is either sampling (mcmc), sampling until converged (adaptive), exhaustive 
+    # enumeration up to a depth (enum) or sampling all participants together (population)
+    parser = argparse.ArgumentParser()
+    parser.add_argument('experiment')
+    parser.add_argument('mode', nargs='?', default='mcmc', choices=MODES)
+    parser.add_argument('depth', nargs='?', default=4, type=int)
+    parser.add_argument('--workers', type=int, default=None)
+    parser.add_argument('--metrics', default=None, help='append the metrics of the samplers to this file, see Monitor.py')
+    parser.add_argument('--profile', default=None, help='store a cProfile of every participant in this directory')
+    parser.add_argument('--verify', action='store_true', help='only check the compiled likelihood of the stored rules of the study')
+    args = parser.parse_args()
+    experiment = args.experiment
+
+    # check that the compiled likelihood of every stored rule equals the per datum likelihood, instead of fitting
+    if args.verify:
+        differ = verifyStudy(experiment)
+        for p, rule in differ:
+            print("Differs:", p, rule)
+        print(len(differ), "stored rules have a different compiled likelihood")
+        sys.exit(1 if differ else 0)
+
+    # load the worksheet of the study, from the cache if the workbook did not change since it was last read
+    data = loadStudy(experiment)
+
+    # find the rules of all participants
+    LoTData = fitStudy(data, args.mode, args.depth, args.workers, 
+                       ckpt=checkpointDir(experiment),
+                       stepsPath="/gpfs/home6/cfermin/SnelLoTThesis/Data/LoT" + experiment + "_steps.csv", 
+                       metrics=args.metrics, profile=args.profile)
+
+    # save the data in the compact format, with the rules in a dictionary, imported here as Results itself imports this file
+    from Results import normalize, saveResults
+    saveResults("/gpfs/home6/cfermin/SnelLoTThesis/Data/LoT" + experiment, *normalize(LoTData))
@@ -0,0 +1,138 @@
+import os
+import sys
+import time
+import hashlib
+import numpy as np
+import pandas as pd
+
+# the workbook with the predictions of the participants of every study
+WORKBOOK = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'Data', 'PredictingOutcomes_ParticipantPredictions.xlsx')
+
+def workbookStamp(path):
+    # a cheap stamp of the workbook, based on the time it was last changed and its size
+    st = os.stat(path)
+    return str(st.st_mtime_ns) + ':' + str(st.st_size)
+
+def workbookHash(path):
+    # the hash of the content of the workbook, used when the stamp changed but the content might not have, e.g. after copying it
+    with open(path, 'rb') as f:
+        return hashlib.sha256(f.read()).hexdigest()
+
+def cachePath(path, experiment):
+    # the cache of a study is stored in a cache folder next to the workbook
+    return os.path.join(os.path.dirname(path), 'cache', 'Study' + experiment + '.npz')
+
+def toColumns(data):
+    """
+    Convert a study sheet into a dictionary of arrays. The sequences are stored as uint8 codes (their binary value) and the predictions as
+    packed bits, other text columns as integer codes with their categories, and numeric columns as they are.
+    """
+    arrays = {}
+    kinds = []
+
+    for col in data.columns:
+        values = data[col]
+        if col == 'sequence':
+            arrays[col] = np.array([int(x, 2) for x in values], dtype=np.uint8)
+            kinds.append('sequence')
+        elif col == 'prediction_raw' and values.isin(['0', '1']).all():
+            arrays[col] = np.packbits(values.to_numpy() == '1')
+            kinds.append('bits')
+        elif pd.api.types.is_numeric_dtype(values):
+            arrays[col] = values.to_numpy()
+            kinds.append('numeric')
+        else:
+            codes, categories = pd.factorize(values)
+            arrays[col] = codes.astype(np.int32)
+            arrays[col + '__categories'] = np.array(categories, dtype=str)
+            kinds.append('text')
+
+    arrays['__rows__'] = np.array(len(data))
+    arrays['__columns__'] = np.array(data.columns, dtype=str)
+    arrays['__kinds__'] = np.array(kinds, dtype=str)
+    return arrays
+
+def fromColumns(arrays):
+    """
+    Convert the arrays of a cached study back into the dataframe of the sheet, with the sequences and predictions as strings.
+    """
+    data = {}
+
+    for col, kind in zip(arrays['__columns__'], arrays['__kinds__']):
+        if kind == 'sequence':
+            data[col] = [format(code, '08b') for code in arrays[col]]
+        elif kind == 'bits':
+            data[col] = np.where(np.unpackbits(arrays[col], count=int(arrays['__rows__'])) == 1, '1', '0')
+        elif kind == 'numeric':
+            data[col] = arrays[col]
+        else:
+            # text is looked up in its categories, where a code of -1 is a missing value
+            codes = arrays[col]
+            categories = arrays[col + '__categories']
+            data[col] = pd.Series(np.where(codes >= 0, categories[np.maximum(codes, 0)], None), dtype=object).infer_objects()
+
+    return pd.DataFrame(data)
+
+def writeCache(cache, arrays):
+    # write to a temporary file of this process first, so processes that write the cache at the same time never leave a broken cache
+    os.makedirs(os.path.dirname(cache), exist_ok=True)
+    tmp = cache + '.' + str(os.getpid()) + '.tmp'
+    with open(tmp, 'wb') as f:
+        np.savez(f, **arrays)
+    os.replace(tmp, cache)
+
+def loadStudy(experiment, path=WORKBOOK):
+    """
+    Load the sheet of a study ('1B', '2B', ...) from the workbook, with the sequence and raw prediction as strings, the same as
+    pd.read_excel(..., dtype={"sequence": str, "prediction_raw": str}). The first load converts the sheet into a columnar cache file,
+    which is used by every later load for as long as the workbook does not change.
+    """
+    cache = cachePath(path, experiment)
+    stamp = workbookStamp(path)
+
+    # use the cache if the workbook has the same stamp, or otherwise the same content, as when the cache was made
+    if os.path.exists(cache):
+        with np.load(cache, allow_pickle=False) as f:
+            arrays = dict(f)
+        if str(arrays['__stamp__']) == stamp:
+            return fromColumns(arrays)
+
+        # the content is the same, so only the stamp is updated, and later loads do not have to hash the workbook again
+        if str(arrays['__hash__']) == workbookHash(path):
+            arrays['__stamp__'] = np.array(stamp)
+            writeCache(cache, arrays)
+            return fromColumns(arrays)
+
+    # read the sheet from the workbook, and store it in the cache
+    data = pd.read_excel(path, 'Study ' + experiment, dtype={"sequence": str, "prediction_raw": str})
+    arrays = toColumns(data)
+    arrays['__stamp__'] = np.array(stamp)
+    arrays['__hash__'] = np.array(workbookHash(path))
+
+    writeCache(cache, arrays)
+
+    return data
+
+# only run this code if the program is run with this file as the main
+if __name__ == '__main__':
+
+    # compare the time of loading a study from the workbook (cold) and from the cache (warm)
+    experiment = sys.argv[1] if len(sys.argv) > 1 else '1B'
+    repeats = 10
+
+    start = time.perf_counter()
+    for _ in range(repeats):
+        cold = pd.read_excel(WORKBOOK, 'Study ' + experiment, dtype={"sequence": str, "prediction_raw": str})
+    coldTime = (time.perf_counter() - start) / repeats
+
+    # make sure the cache exists, and then time loading from it
+    loadStudy(experiment)
+    start = time.perf_counter()
+    for _ in range(repeats):
+        warm = loadStudy(experiment)
+    warmTime = (time.perf_counter() - start) / repeats
+
+    print("Cold Excel load: ", round(coldTime * 1000, 2), "ms")
+    print("Warm cache load: ", round(warmTime * 1000, 2), "ms")
+    print("Speedup: ", round(coldTime / warmTime, 1), "x")
+    print("Cache size: ", os.path.getsize(cachePath(WORKBOOK, experiment)), "bytes, identical: ", cold.equals(warm))
@@ -0,0 +1,71 @@
+import time
+import json
+import random
+import asyncio
+import argparse
+import numpy as np
+
+async def client(requests, latencies, host, port, socket):
+    """
+    Send the requests one after the other over a single connection, as a client of the prediction service, and store the latency of each.
+    """
+    if socket:
+        reader, writer = await asyncio.open_unix_connection(socket)
+    else:
+        reader, writer = await asyncio.open_connection(host, port)
+
+    for request in requests:
+        body = json.dumps(request).encode()
+        start = time.perf_counter()
+        writer.write(b'POST /predict HTTP/1.1\r\nContent-Type: application/json\r\nContent-Length: ' + str(len(body)).encode() +
+                     b'\r\n\r\n' + body)
+        head = await reader.readuntil(b'\r\n\r\n')
+        length = int(head.split(b'Content-Length: ')[1].split(b'\r\n')[0])
+        await reader.readexactly(length)
+        latencies.append(time.perf_counter() - start)
+
+    writer.close()
+
+def makeRequests(n, participants, generators, batch, seed):
+    # random requests, half for a participant and half for the model average of a generator, each with a batch of random sequences
+    rng = random.Random(seed)
+    requests = []
+    for _ in range(n):
+        seqs = [format(rng.randrange(256), '08b') for _ in range(batch)]
+        if rng.random() < 0.5:
+            requests.append({'p_id' : rng.choice(participants), 'sequences' : seqs})
+        else:
+            requests.append({'generator' : rng.choice(generators), 'sequences' : seqs})
+    return requests
+
+async def loadTest(n, clients, batch, host, port, socket, participants, generators, seed):
+    # spread the requests over the clients, which all run at the same time, and return the latencies and total time
+    requests = makeRequests(n, participants, generators, batch, seed)
+    latencies = []
+    start = time.perf_counter()
+    await asyncio.gather(*[client(requests[c::clients], latencies, host, port, socket) for c in range(clients)])
+    return np.array(latencies), time.perf_counter() - start
+
+# only run this code if the program is run with this file as the main
+if __name__ == '__main__':
+
+    # send requests to a running prediction service (see Service.py) and report the latency and throughput
+    parser = argparse.ArgumentParser(description='Load test the prediction service.')
+    parser.add_argument('--requests', type=int, default=20000)
+    parser.add_argument('--clients', type=int, default=8)
+    parser.add_argument('--batch', type=int, default=16, help='the number of sequences per request')
+    parser.add_argument('--participants', type=int, default=300, help='participants 1 up to this number are requested')
+    parser.add_argument('--generators', nargs='+', default=['bingo', 'stock', 'analyst'])
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8787)
+    parser.add_argument('--socket', default=None)
+    parser.add_argument('--seed', type=int, default=7331)
+    args = parser.parse_args()
+
+    latencies, total = asyncio.run(loadTest(args.requests, args.clients, args.batch, args.host, args.port, args.socket,
+                                            list(range(1, args.participants + 1)), args.generators, args.seed))
+
+    print("Requests:", len(latencies), "clients:", args.clients, "sequences per request:", args.batch)
+    print("p50 latency:", round(np.percentile(latencies, 50) * 1e6, 1), "us")
+    print("p99 latency:", round(np.percentile(latencies, 99) * 1e6, 1), "us")
+    print("Requests/sec:", round(len(latencies) / total, 1))
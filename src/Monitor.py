@@ -0,0 +1,176 @@
+import os
+import json
+import time
+import pstats
+import cProfile
+import argparse
+from contextlib import contextmanager
+
+class ChainMonitor:
+    """
+    Collects the metrics of the sampler of a single participant: the number of steps, how many proposals were accepted, the time spent
+    computing likelihoods and the rest of the time spent in the sampler (proposing, the prior and accepting), and a trace of the best
+    posterior so far. If a path is given, the metrics are appended to it as json lines: a progress line every so many steps and a final
+    line when the participant is done. Several workers can write to the same file, as every line is written at once.
+    """
+    def __init__(self, samp, data, path=None, total=None, every=10000):
+        self.samp = samp
+        self.data = data
+        self.path = path
+        self.total = total
+        self.every = every
+
+        self.steps = 0
+        self.accepted = 0
+        self.sampling = 0.0
+        self.best = -float('inf')
+        self.trace = []
+        self.start = time.time()
+
+    def emit(self, record):
+        # append a record as a single line, written with a single call so lines of different workers do not get mixed
+        if self.path:
+            fd = os.open(self.path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+            try:
+                os.write(fd, (json.dumps(record) + '\n').encode())
+            finally:
+                os.close(fd)
+
+    def watch(self, sampler, done=0):
+        """
+        Go over the hypotheses of a sampler, like iterating the sampler itself, while keeping the metrics. Only the time spent inside the
+        sampler is counted, not the time spent on the hypotheses by the caller. A step is accepted when the sampler moves to a new hypothesis.
+        Done is the number of steps the chain already took before, e.g. when it continues from a checkpoint.
+        """
+        current = None
+        sampler = iter(sampler)
+        while True:
+            start = time.perf_counter()
+            h = next(sampler, None)
+            self.sampling += time.perf_counter() - start
+            if h is None:
+                return
+
+            self.steps += 1
+            self.accepted += h is not current
+            current = h
+
+            if h.posterior_score > self.best:
+                self.best = h.posterior_score
+            if (done + self.steps) % self.every == 0:
+                self.trace.append([done + self.steps, self.best])
+                self.emit({'event' : 'progress', 'p_id' : self.samp, 'pid' : os.getpid(), 'time' : time.time(),
+                           'step' : done + self.steps, 'total' : self.total, 'best_posterior' : self.best})
+            yield h
+
+    def record(self):
+        # the metrics of the participant so far
+        seconds = time.time() - self.start
+        likelihood = getattr(self.data, 'seconds', 0.0)
+        return {'event' : 'done', 'p_id' : self.samp, 'pid' : os.getpid(), 'time' : time.time(), 'steps' : self.steps,
+                'wallclock' : seconds, 'steps_per_sec' : self.steps / seconds if seconds else 0.0,
+                'acceptance' : self.accepted / self.steps if self.steps else 0.0, 'likelihood_sec' : likelihood,
+                'proposal_sec' : self.sampling - likelihood, 'best_posterior' : self.best, 'trace' : self.trace}
+
+    def finish(self):
+        # write the final metrics of the participant, and return them
+        record = self.record()
+        self.emit(record)
+        return record
+
+@contextmanager
+def profiled(directory, samp):
+    """
+    Profile the code in the block with cProfile if a directory is given, and store the statistics in it as p<samp>.prof. The statistics of
+    all participants can be combined with summarizeProfiles.
+    """
+    if not directory:
+        yield
+        return
+
+    os.makedirs(directory, exist_ok=True)
+    profile = cProfile.Profile()
+    profile.enable()
+    try:
+        yield
+    finally:
+        profile.disable()
+        profile.dump_stats(os.path.join(directory, 'p' + str(samp) + '.prof'))
+
+def summarizeProfiles(directory, top=25):
+    # print the functions with the most cumulative time over the profiles of all participants in the directory
+    files = [os.path.join(directory, f) for f in sorted(os.listdir(directory)) if f.endswith('.prof')]
+    if not files:
+        print("No profiles in", directory)
+        return
+    stats = pstats.Stats(*files)
+    stats.sort_stats('cumulative').print_stats(top)
+
+def readMetrics(path):
+    # read all records of a metrics file, skipping a last line that is still being written
+    records = []
+    with open(path) as f:
+        for line in f:
+            try:
+                records.append(json.loads(line))
+            except json.JSONDecodeError:
+                pass
+    return records
+
+def progress(path, participants=None, steps=None):
+    """
+    Combine the metrics of all workers into the progress of the whole run: the number of finished participants, the steps taken, the
+    number of steps per second over all workers and, if the number of participants and steps per participant are known, the estimated
+    time until the run is finished.
+    """
+    records = readMetrics(path)
+    done = {r['p_id'] : r for r in records if r['event'] == 'done'}
+
+    # the last reported step of every participant that is still running
+    running = {}
+    for r in records:
+        if r['event'] == 'progress' and r['p_id'] not in done:
+            running[r['p_id']] = r
+
+    taken = sum(r['steps'] for r in done.values()) + sum(r['step'] for r in running.values())
+    times = [r['time'] for r in records]
+    start = min([r['time'] - r['wallclock'] for r in done.values()] + times) if records else time.time()
+    elapsed = max(time.time() - start, 1e-9)
+    rate = taken / elapsed
+
+    view = {'finished' : len(done), 'running' : len(running), 'workers' : len({r['pid'] for r in running.values()}), 'steps' : taken,
+            'elapsed' : elapsed, 'steps_per_sec' : rate, 'eta' : None}
+    if participants and steps and rate:
+        view['eta'] = max(participants * steps - taken, 0) / rate
+
+    # the slowest participants and the mean acceptance of the finished ones
+    if done:
+        view['acceptance'] = sum(r['acceptance'] for r in done.values()) / len(done)
+        view['slowest'] = sorted(((r['steps_per_sec'], p) for p, r in done.items()))[:5]
+    return view
+
+# only run this code if the program is run with this file as the main
+if __name__ == '__main__':
+
+    # show the progress of a run from its metrics file, optionally repeating every so many seconds, or summarize the profiles of a run
+    parser = argparse.ArgumentParser(description='Show the progress of a run of LoT.py from its metrics, or summarize its profiles.')
+    parser.add_argument('path', help='the metrics file, or the profile directory with --profile')
+    parser.add_argument('--participants', type=int, default=None)
+    parser.add_argument('--steps', type=int, default=500000)
+    parser.add_argument('--watch', type=float, default=0, help='seconds between updates, 0 to show the progress once')
+    parser.add_argument('--profile', action='store_true')
+    args = parser.parse_args()
+
+    if args.profile:
+        summarizeProfiles(args.path)
+    else:
+        while True:
+            view = progress(args.path, args.participants, args.steps)
+            eta = 'unknown' if view['eta'] is None else str(round(view['eta'] / 60, 1)) + ' min'
+            print("Finished:", view['finished'], "running:", view['running'], "on", view['workers'], "workers, steps:", view['steps'],
+                  "steps/sec:", round(view['steps_per_sec'], 1), "ETA:", eta)
+            if 'acceptance' in view:
+                print("Mean acceptance:", round(view['acceptance'], 3), "slowest (steps/sec, p_id):", view['slowest'])
+            if not args.watch:
+                break
+            time.sleep(args.watch)
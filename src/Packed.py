@@ -0,0 +1,179 @@
+import argparse
+from math import log
+from functools import lru_cache
+from Primitives import parseRule, compileRule, ZERO, ONE, FALSE, NONE
+
+# invert_ on an output code, it flips a bit and returns None for both False and None, the same as INVERT_T
+INVERT = (ONE, ZERO, NONE, NONE)
+
+def packSeq(x):
+    # a sequence as an integer, the first outcome is the highest bit, so for 8 outcomes this is its position in SEQS
+    return int(x, 2)
+
+@lru_cache(maxsize=None)
+def patternIndex(length):
+    """
+    Create the index of the sequences of the given length that contain a pattern, from the sequence to the code of its continuation. Like
+    createPat, a pattern is a block of k bits that repeats itself at least once, either as it is or flipped on every other repeat, and
+    blocks of half the length are tried first down to blocks of 3 bits. A sequence that fits more than one pattern keeps the continuation
+    of the first, so for 8 outcomes this gives the same continuation as patternCont_ on every sequence. Looking up a sequence is a single
+    hash, however long it is.
+    """
+    index = {}
+    for k in range(length // 2, 2, -1):
+        reps = -(-(length + 1) // k)
+        for flip in (False, True):
+            for block in range(1 << k):
+                other = block ^ ((1 << k) - 1) if flip else block
+
+                # repeat the block over one bit more than the length, the last bit is the continuation
+                bits = 0
+                for r in range(reps):
+                    bits = (bits << k) | (other if r % 2 else block)
+                bits >>= reps * k - (length + 1)
+                index.setdefault(bits >> 1, bits & 1)
+    return index
+
+class PackedPrimitives:
+    """
+    The primitives of the grammar for sequences of any length, packed into an integer (see packSeq). Unlike the string primitives they
+    return the output codes of the truth tables (ZERO, ONE, FALSE and NONE), and every call takes the same number of operations for any
+    length up to a machine word: get_ is a shift, streak_ a mask test, balance_ and conform_ a popcount and patternCont_ a lookup.
+    """
+    def __init__(self, length):
+        self.length = length
+        self.index = patternIndex(length)
+
+        # the shift of every index, and the mask of the outcomes from every index up to the end of the sequence
+        self.shifts = [length - 1 - i for i in range(length)]
+        self.masks = [(1 << (length - i)) - 1 for i in range(length + 1)]
+
+    def get_(self, x, i):
+        return (x >> self.shifts[i]) & 1
+
+    def streak_(self, x, i):
+        # the last outcome if all outcomes from i onwards are 1
+        m = self.masks[min(i, self.length)]
+        if x & m == m:
+            return x & 1
+        return FALSE
+
+    def balance_(self, x, n):
+        ones = x.bit_count()
+        if ones < n:
+            return ONE
+        elif self.length - ones < n:
+            return ZERO
+        return FALSE
+
+    def conform_(self, x, n):
+        ones = x.bit_count()
+        if ones < n:
+            return ZERO
+        elif self.length - ones < n:
+            return ONE
+        return FALSE
+
+    def patternCont_(self, x):
+        return self.index.get(x, FALSE)
+
+    def invert_(self, r):
+        return INVERT[r]
+
+    def else_(self, r, r2):
+        if r != FALSE:
+            return r
+        return r2
+
+@lru_cache(maxsize=None)
+def packedPrimitives(length):
+    # the primitives of every length are only created once, as the pattern index of long sequences takes a moment
+    return PackedPrimitives(length)
+
+def closureOf(tree, prims):
+    """
+    Turn a parsed rule (see Primitives.parseRule) into a function of a packed sequence that returns the output code of the rule. The
+    arguments of the primitives are fixed when the rule is compiled, and else_ only evaluates its second rule when the first returns False.
+    """
+    if tree[0] == 'bit':
+        out = int(tree[1])
+        return lambda x: out
+    name, args = tree
+    if name == 'else_':
+        first, second = closureOf(args[0], prims), closureOf(args[1], prims)
+        return lambda x: r if (r := first(x)) != FALSE else second(x)
+    if name == 'invert_':
+        inner = closureOf(args[0], prims)
+        return lambda x: INVERT[inner(x)]
+    if args[0] != ('x',) or any(arg[0] != 'int' for arg in args[1:]):
+        raise ValueError("Invalid rule: " + name)
+    fn = getattr(prims, name)
+    consts = [arg[1] for arg in args[1:]]
+    return lambda x: fn(x, *consts)
+
+@lru_cache(maxsize=65536)
+def compilePacked(rule, length):
+    """
+    Compile a rule into a function of a packed sequence of the given length, which returns the output code of the rule. This takes the
+    place of the truth table of compileRule for sequences that are too long to tabulate.
+    """
+    try:
+        return closureOf(parseRule(rule), packedPrimitives(length))
+    except (TypeError, IndexError) as e:
+        raise ValueError("Invalid rule: " + rule) from e
+
+class PackedData(list):
+    """
+    The trials of a participant on sequences of any length, as the counts of each prediction for each distinct sequence. MyHypothesis
+    scores a rule on this data with ruleLikelihood, which calls the packed rule once per distinct sequence, with the same noise model
+    as MyHypothesis.compute_single_likelihood.
+    """
+    def __init__(self, sequences, predictions, alpha=0.999):
+        list.__init__(self, zip(sequences, predictions))
+        self.length = len(sequences[0]) if len(sequences) else 8
+
+        # count how often each bit is predicted for each sequence, predictions that are not a bit can never be correct
+        counts = {}
+        for x, pred in self:
+            if str(pred) in ('0', '1'):
+                counts.setdefault(packSeq(x), [0, 0])[int(pred)] += 1
+        self.seqs = list(counts)
+        self.counts = list(counts.values())
+
+        self.hit = log((1.0-alpha)/100. + alpha)
+        self.miss = log((1.0-alpha)/100)
+
+        # the likelihoods of the behaviours that were already scored, and the time spent on them, as in CompiledData
+        self.memo = {}
+        self.seconds = 0.0
+
+    def ruleLikelihood(self, rule):
+        f = compilePacked(rule, self.length)
+        outs = bytes(f(x) for x in self.seqs)
+        if outs not in self.memo:
+            hits = sum(c[o] for c, o in zip(self.counts, outs) if o <= ONE)
+            self.memo[outs] = hits * self.hit + (len(self) - hits) * self.miss
+        return self.memo[outs]
+
+def verifyPacked(depth=2):
+    """
+    Check that the packed primitives of 8 outcomes behave exactly like the truth tables of the string primitives, for every rule of the
+    grammar with at most depth else_ links, on all 256 sequences. Returns the rules that differ.
+    """
+    # the grammar is only needed to enumerate the rules, so LOTlib3 is not loaded when the packed primitives are used
+    from LoT import enumerateRules
+    space = enumerateRules(depth)
+    return [rule for rule in space.rules if [compilePacked(rule, 8)(x) for x in range(256)] != compileRule(rule).tolist()]
+
+# only run this code if the program is run with this file as the main
+if __name__ == '__main__':
+
+    # check the packed primitives against the truth tables, their speed per length is measured in Benchmark.py
+    parser = argparse.ArgumentParser(description='Check the bit packed primitives against the truth tables of the string primitives.')
+    parser.add_argument('--depth', type=int, default=2)
+    args = parser.parse_args()
+
+    differ = verifyPacked(args.depth)
+    for rule in differ:
+        print("Differs:", rule)
+    print(len(differ), "rules behave differently with the packed primitives")
@@ -0,0 +1,134 @@
+import os
+import json
+import time
+import pickle
+import hashlib
+import argparse
+import numpy as np
+import LoT
+import Primitives
+import BestRule
+import BayInf
+import InterpretRule
+import LoadData
+import Results
+from LoadData import loadStudy, workbookHash, WORKBOOK
+from Results import normalize, saveResults
+
+# the folder with the data, the folder where the output of every stage is cached, and the folder the results are written to by default,
+# so the results of the thesis in the data folder are only replaced when that is asked for
+DATA = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'Data')
+CACHE = os.path.join(DATA, 'pipeline')
+OUTPUT = os.path.join(CACHE, 'results')
+
+# the studies that are run when all studies are asked for
+STUDIES = ['2B', '1B']
+
+def sourceHash(*modules):
+    # the hash of the source code of the modules a stage uses, so a stage is rerun when its code changes
+    digest = hashlib.sha256()
+    for module in modules:
+        with open(module.__file__, 'rb') as f:
+            digest.update(f.read())
+    return digest.hexdigest()
+
+def stage(name, params, inputs, modules, fn, cache=CACHE):
+    """
+    Run a stage of the pipeline, or load its output from the cache. The output is stored under a key that is the hash of the name of the
+    stage, its parameters, the keys of the stages it takes as input and the source code of its modules, so a stage only reruns if one of
+    those changed. Returns the key and the output of the stage.
+    """
+    key = hashlib.sha256(json.dumps([name, params, inputs, sourceHash(*modules)], sort_keys=True).encode()).hexdigest()[:16]
+    path = os.path.join(cache, name + '-' + key + '.pkl')
+
+    if os.path.exists(path):
+        print("Cached:", name, key)
+        with open(path, 'rb') as f:
+            return key, pickle.load(f)
+
+    print("Running:", name, key)
+    start = time.perf_counter()
+    output = fn()
+    print("Finished:", name, round(time.perf_counter() - start, 2), "s")
+
+    # write to a temporary file first, so an interrupted run never leaves a broken cache entry
+    os.makedirs(cache, exist_ok=True)
+    with open(path + '.tmp', 'wb') as f:
+        pickle.dump(output, f, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(path + '.tmp', path)
+
+    return key, output
+
+def runStudy(experiment, args):
+    """
+    Run the stages of a single study: fitting the LoT model, selecting the best rules, and the cross-validation. Each stage is handed the
+    output of the previous stage in memory, and the final output of each stage is also written to the output folder. Returns the key and
+    the best rules and rule dictionary of the study.
+    """
+    # the sheet of the study, which is identified by the content of the workbook
+    data = loadStudy(experiment)
+    sheet = workbookHash(WORKBOOK) + ':' + experiment
+
+    # find the rules of every participant, with the LoT model
+    fitKey, (LoTData, rules) = stage('fit', {'experiment' : experiment, 'mode' : args.mode, 'depth' : args.depth}, [sheet],
+                                     [LoT, Primitives, Results, LoadData], lambda: normalize(LoT.fitStudy(data, args.mode, args.depth, args.workers)),
+                                     args.cache)
+    saveResults(os.path.join(args.output, 'LoT' + experiment), LoTData, rules)
+
+    # get the best rules of each participant
+    bestKey, BRule = stage('best', {}, [fitKey, sheet], [BestRule, Primitives, Results], lambda: BestRule.selectBestRules(LoTData, rules, data),
+                           args.cache)
+    saveResults(os.path.join(args.output, 'BestRules' + experiment), BRule, rules, csv=True)
+
+    # perform both cross-validation methods, and check how well the rule of every participant generalizes to every other participant
+    def validate():
+        CVResults, summary = BayInf.crossValidate(BRule, args.k, args.seed, args.repeats)
+        matrix, means = BayInf.singleRuleValidation(CVResults, rules, CVResults)
+        return CVResults, matrix, summary
+    cvKey, (CVResults, matrix, summary) = stage('cv', {'k' : args.k, 'seed' : args.seed, 'repeats' : args.repeats}, [bestKey], [BayInf, Primitives, Results],
+                                       validate, args.cache)
+    saveResults(os.path.join(args.output, 'CVResults' + experiment), CVResults, rules, csv=True)
+    with open(os.path.join(args.output, 'CVSummary' + experiment + '.json'), 'w') as f:
+        json.dump(summary, f, indent=2)
+    print("Mean accuracy of k-fold:", summary['kfold_mean'], "LOOCV:", summary['loocv_mean'])
+    print("95% CI of repeated k-fold:", summary['repeated_ci'])
+    np.savez_compressed(os.path.join(args.output, 'RuleMatrix' + experiment + '.npz'), accuracy=matrix.to_numpy().astype(np.float32),
+                        rule_p_id=matrix.index.to_numpy(), data_p_id=matrix.columns.to_numpy())
+
+    return bestKey, (BRule, rules)
+
+# only run this code if the program is run with this file as the main
+if __name__ == '__main__':
+
+    # get the studies to run, the mode of the LoT model and the settings of the cross-validation
+    parser = argparse.ArgumentParser(description='Run the LoT model, best rule selection, cross-validation and rule interpretation.')
+    parser.add_argument('study', choices=STUDIES + ['all'])
+    parser.add_argument('--mode', default='enum', choices=LoT.MODES)
+    parser.add_argument('--depth', type=int, default=4)
+    parser.add_argument('--k', type=int, default=6)
+    parser.add_argument('--seed', type=int, default=7331)
+    parser.add_argument('--repeats', type=int, default=100)
+    parser.add_argument('--workers', type=int, default=None)
+    parser.add_argument('--cache', default=CACHE)
+    parser.add_argument('--output', default=OUTPUT, help='the folder the results are written to, ../Data replaces the results of the thesis')
+    args = parser.parse_args()
+    os.makedirs(args.output, exist_ok=True)
+
+    studies = STUDIES if args.study == 'all' else [args.study]
+    start = time.perf_counter()
+
+    keys = []
+    results = {}
+    for experiment in studies:
+        key, results[experiment] = runStudy(experiment, args)
+        keys.append(key)
+
+    # compute the data for the rule interpretation plot, and how often each primitive produced the predictions, of all studies that were run
+    _, (ruleIntPlot, ruleRespPlot) = stage('interpret', {'studies' : studies}, keys, [InterpretRule, Primitives, Results],
+                                           lambda: (InterpretRule.ruleInterpretation(results), InterpretRule.ruleResponsibility(results)),
+                                           args.cache)
+    suffix = '' if args.study == 'all' else args.study
+    ruleIntPlot.to_csv(os.path.join(args.output, 'ruleIntPlotData' + suffix + '.csv'), index=False)
+    ruleRespPlot.to_csv(os.path.join(args.output, 'ruleRespPlotData' + suffix + '.csv'), index=False)
+
+    print("Pipeline finished in", round(time.perf_counter() - start, 2), "s")
@@ -0,0 +1,304 @@
+import os
+import re
+import hashlib
+from functools import lru_cache
+import numpy as np
+
+# the primitives of the grammar and the compiled truth tables of rules, which is all the analysis needs to evaluate a rule, without the
+# LOTlib3 library and the grammar that LoT.py loads for the fitting
+
+# the folder where the truth tables of the primitives are cached, next to the cached studies
+CACHE = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'Data', 'cache')
+
+def invert_(pat):
+
+    # this function returns the flipped version of the input e.g., "110" becomes "001", but only if the input is not False
+    if pat:
+        return ''.join('1' if c == '0' else '0' for c in pat)
+
+def createPat():
+    """
+    This function is used to create the binary strings with patterns that repeat themselves at least once. They are created from all versions
+    of 4 and 3 bit long binary strings that are repeated 2 or three times respectively.
+    """
+    # initialize the lists
+    bit_sets = list()
+    binary_str = list()
+
+    # create the 16 versions of three bit binary strings
+    for i in range(1 << 4):
+        # Convert the current number to a binary string of length n
+        bit_sets.append(format(i, '0' + str(4) + 'b'))
+
+    # repeat the 16 created 4 bit patterns.
+    binary_str = [st * 2 + st[0] for st in bit_sets]
+
+    # add patterns that are flipped versions
+    binary_str = binary_str + [st + invert_(st) + st[0] for st in bit_sets]
+
+    # initialize the lists
+    binary_str3 = list()
+    bit_sets3 = list()
+
+    # create the 8 versions of three bit binary strings
+    for i in range(1 << 3):
+        # Convert the current number to a binary string of length n
+        bit_sets3.append(format(i, '0' + str(3) + 'b'))
+    
+    # repeat the 16 created 4 bit patterns.
+    binary_str3 = [st * 3 for st in bit_sets3]
+
+    # add patterns that are flipped versions
+    binary_str3 = binary_str3 + [st + invert_(st) + st for st in bit_sets3]
+
+    # add 3 bit patterns to other 4 bit binary strings
+    for st in binary_str3:
+        if st not in binary_str:
+            binary_str.append(st)
+
+    # return the list of patterned binary strings
+    return binary_str
+
+@lru_cache(maxsize=None)
+def patterns():
+    # the list of binary strings containing all valid patterns (bin_str), which is only created when it is first used
+    return createPat()
+
+# create primitive that takes a the ith character from the given input string x
+def get_(x, i): 
+    return (x[i])
+
+def streak_(x, i): 
+    if all(list(map(int,list(x[i:8])))):
+        return x[7]
+    return False
+
+def patternCont_(x):
+    """
+    This primitive checks whether x (the input) contains one of the patterned binary strings (bin_str) and returns the 
+    continuation of the pattern. If x is not in bin_str it returns False.
+    """
+
+    # loop over all patterns
+    for pat in patterns():
+
+        # check if the pattern is present in x and return its continuation
+        if pat[0:8] == x:
+            return pat[8]
+        
+    # otherwise return False
+    return False
+
+# A balance function
+def balance_(x, n): 
+    if x.count("1") < n:
+        return "1"
+    elif x.count("0") < n:
+        return "0"
+    return False
+
+
+def conform_(x, n): 
+    if x.count("1") < n:
+        return "0"
+    elif x.count("0") < n:
+        return "1"
+    return False
+
+# The binding function, which takes two RULES and returns the results of the one that does not return False
+def else_(r, r2):
+    if r != False:
+        return r
+    return r2
+
+# all 256 possible input sequences, the position of a sequence in this list is equal to its binary value
+SEQS = [format(i, '08b') for i in range(256)]
+
+# the codes that represent the possible outputs of a rule in a truth table, note that invert_ returns None for a False input
+ZERO, ONE, FALSE, NONE = 0, 1, 2, 3
+
+def encodeOut(out):
+    """
+    Translate a single output of a rule ('0', '1', False or None) into its code in the truth tables.
+    """
+    if out is False:
+        return FALSE
+    if out is None:
+        return NONE
+    return int(out)
+
+# the outputs that belong to each code, to translate truth tables back into the outputs of the rules
+OUTPUTS = np.array(['0', '1', False, None], dtype=object)
+
+def seqCodes(sequences):
+    # the position of each sequence in SEQS, which is also its row in a truth table
+    return np.array([int(x, 2) for x in sequences], dtype=np.intp)
+
+def tabulate(fn, *args):
+    """
+    Create the truth table of a primitive by applying it to all 256 sequences, the result is an array of output codes.
+    """
+    table = np.array([encodeOut(fn(s, *args)) for s in SEQS], dtype=np.int8)
+    table.setflags(write=False)
+    return table
+
+# the arguments every primitive is tabulated for, patternCont_ has no arguments and a single table
+TABLE_ARGS = {'get_' : range(8), 'streak_' : range(8), 'balance_' : range(9), 'conform_' : range(9)}
+
+def sourceKey():
+    # the hash of this file, so the cached tables are built again when the primitives change
+    with open(os.path.abspath(__file__), 'rb') as f:
+        return hashlib.sha256(f.read()).hexdigest()[:16]
+
+@lru_cache(maxsize=None)
+def primitiveTables(cache=CACHE):
+    """
+    The truth tables of every primitive for every argument it can get, as a dictionary from the name of the primitive to its table per
+    argument. The tables are only built when the first rule is compiled, and are cached on disk under the hash of this file, so every
+    later process loads them instead of building them again.
+    """
+    path = os.path.join(cache, 'Primitives-' + sourceKey() + '.npz')
+    if os.path.exists(path):
+        with np.load(path, allow_pickle=False) as f:
+            arrays = {key : f[key] for key in f.files}
+    else:
+        arrays = {name + '/' + str(a) : tabulate(globals()[name], a) for name, args in TABLE_ARGS.items() for a in args}
+        arrays['patternCont_'] = tabulate(patternCont_)
+
+        # write to a temporary file of this process first, so processes that build the tables at the same time never read a broken file,
+        # a data folder that can not be written to only means that every process builds the tables itself
+        try:
+            os.makedirs(cache, exist_ok=True)
+            with open(path + '.' + str(os.getpid()) + '.tmp', 'wb') as f:
+                np.savez(f, **arrays)
+            os.replace(path + '.' + str(os.getpid()) + '.tmp', path)
+        except OSError:
+            pass
+
+    tables = {name : {} for name in TABLE_ARGS}
+    for key, table in arrays.items():
+        table.setflags(write=False)
+        name, _, arg = key.partition('/')
+        if arg:
+            tables[name][int(arg)] = table
+        else:
+            tables[name] = table
+    return tables
+
+def __getattr__(name):
+    # bin_str is only created when it is first used
+    if name == 'bin_str':
+        return patterns()
+    raise AttributeError("module 'Primitives' has no attribute " + repr(name))
+
+# invert_ flips a bit, and returns None for both False and None, so it can be applied to a table with a single lookup
+INVERT_T = np.array([ONE, ZERO, NONE, NONE], dtype=np.int8)
+
+def asTable(r):
+    """
+    Turn a constant bit, such as '1', into a truth table, tables themselves are returned as they are.
+    """
+    if isinstance(r, str):
+        return np.full(len(SEQS), int(r), dtype=np.int8)
+    return r
+
+def else_T(r, r2):
+    # take the output of the first rule, unless it returns False, exactly like else_
+    return np.where(asTable(r) == FALSE, asTable(r2), asTable(r))
+
+# the table versions of the primitives, used to evaluate a rule over all sequences at once
+TABLE_PRIMITIVES = {
+    'get_': lambda x, i: primitiveTables()['get_'][i],
+    'streak_': lambda x, i: primitiveTables()['streak_'][i],
+    'balance_': lambda x, n: primitiveTables()['balance_'][n],
+    'conform_': lambda x, n: primitiveTables()['conform_'][n],
+    'patternCont_': lambda x: primitiveTables()['patternCont_'],
+    'invert_': lambda pat: INVERT_T[asTable(pat)],
+    'else_': else_T
+}
+
+def ruleBody(rule):
+    """
+    Strip the quotes and 'lambda x:' of a rule as it is printed by LOTlib3, so that only the expression itself remains.
+    """
+    rule = rule.strip().strip('"').strip()
+    if rule.startswith('lambda x:'):
+        rule = rule[len('lambda x:'):].strip()
+    return rule
+
+# the tokens of a rule: names of primitives or x, numbers, quoted bits, and brackets or commas
+TOKEN = re.compile(r"\s*(?:(?P<name>[A-Za-z_]\w*)|(?P<int>\d+)|'(?P<bit>[01])'|(?P<punct>[(),]))")
+
+def parseRule(rule):
+    """
+    Parse a rule into a nested tuple, where a primitive becomes (name, [arguments]), x becomes ('x',), a number becomes ('int', n) and a 
+    quoted bit becomes ('bit', '1'). Only the primitives of the grammar are accepted, anything else raises a ValueError, so unlike eval 
+    a rule string can never run other code.
+    """
+    body = ruleBody(rule)
+
+    # split the rule into tokens
+    tokens = []
+    pos = 0
+    while pos < len(body):
+        m = TOKEN.match(body, pos)
+        if not m or m.end() == pos:
+            raise ValueError("Invalid rule: " + rule)
+        tokens.append((m.lastgroup, m.group(m.lastgroup)))
+        pos = m.end()
+
+    def parse(i):
+        # parse the expression that starts at token i, and return it with the position of the token after it
+        if i >= len(tokens):
+            raise ValueError("Incomplete rule: " + rule)
+        kind, value = tokens[i]
+        if kind == 'int':
+            return ('int', int(value)), i + 1
+        if kind == 'bit':
+            return ('bit', value), i + 1
+        if kind == 'name' and value == 'x':
+            return ('x',), i + 1
+        if kind != 'name' or value not in TABLE_PRIMITIVES or tokens[i + 1:i + 2] != [('punct', '(')]:
+            raise ValueError("Invalid rule: " + rule)
+
+        # parse the arguments of the primitive up to the closing bracket
+        args = []
+        i += 2
+        while tokens[i:i + 1] != [('punct', ')')]:
+            if args:
+                if tokens[i:i + 1] != [('punct', ',')]:
+                    raise ValueError("Invalid rule: " + rule)
+                i += 1
+            arg, i = parse(i)
+            args.append(arg)
+        return (value, args), i + 1
+
+    tree, end = parse(0)
+    if end != len(tokens):
+        raise ValueError("Invalid rule: " + rule)
+    return tree
+
+def tableOf(tree):
+    # evaluate a parsed rule with the table versions of the primitives, arguments such as numbers are returned as they are
+    if tree[0] == 'x':
+        return None
+    if tree[0] in ('int', 'bit'):
+        return tree[1]
+    return TABLE_PRIMITIVES[tree[0]](*[tableOf(arg) for arg in tree[1]])
+
+@lru_cache(maxsize=65536)
+def compileRule(rule):
+    """
+    Compile a rule into its truth table, an array with the output code of the rule for each of the 256 sequences. The rule is parsed and 
+    evaluated once with the table versions of the primitives, so afterwards it never has to be called on a single sequence again. The 
+    tables of the most recent rules are kept in a bounded cache, so each distinct rule string is only compiled once.
+    """
+    try:
+        table = asTable(tableOf(parseRule(rule)))
+    except (TypeError, KeyError, IndexError) as e:
+        raise ValueError("Invalid rule: " + rule) from e
+    if not isinstance(table, np.ndarray):
+        raise ValueError("Invalid rule: " + rule)
+    table = table.astype(np.int8)
+    table.setflags(write=False)
+    return table
@@ -0,0 +1,104 @@
+import os
+import time
+import shutil
+import argparse
+import tempfile
+import pandas as pd
+from LoT import refitStudy, checkpointDir, MODES
+from LoadData import loadStudy
+from Results import loadResults, saveResults, normalize, denormalize
+from BestRule import updateBestRules
+from BayInf import updateCrossValidation
+
+# the folder with the stored results of every study
+DATA = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'Data')
+
+def remap(base, rules):
+    """
+    Load stored results (e.g. BestRules<experiment>) with the rule ids of the dictionary rules. Results that were read from a csv get a
+    dictionary of their own, whose ids do not match those of the LoT results, so their rules are looked up again by their expression.
+    Returns the facts and the dictionary, which has the rules of the stored results added if they were not in it yet.
+    """
+    facts, stored = loadResults(base)
+    return normalize(denormalize(facts, stored), rules)
+
+def refit(experiment, mode='mcmc', depth=4, workers=None, ckpt=None, steps=50000, k=6, seed=7331, data=DATA, study=None):
+    """
+    Update the stored results of a study (LoT<experiment>, BestRules<experiment> and CVResults<experiment>) after its sheet got new
+    participants or trials, only fitting the new and changed participants (see LoT.refitStudy) and only updating the rows they affect.
+    The sheet of the study is read from the workbook, unless it is given. The chains are warm started from the checkpoint directory that
+    LoT.py writes to, unless another one is given.
+    """
+    study = loadStudy(experiment) if study is None else study
+    ckpt = checkpointDir(experiment) if ckpt is None else ckpt
+    facts, rules = loadResults(os.path.join(data, 'LoT' + experiment))
+
+    # the stored best rules have a row for every trial a participant was fitted on, which tells which participants changed
+    seen, _ = loadResults(os.path.join(data, 'BestRules' + experiment))
+
+    # fit the new and changed participants, the rules keep their ids in the dictionary
+    LoTData, affected = refitStudy(study, facts, rules, seen, mode, depth, workers, ckpt, steps)
+    if not affected:
+        print("The stored results are up to date")
+        return
+    mvData, rules = normalize(LoTData, rules)
+    saveResults(os.path.join(data, 'LoT' + experiment), mvData, rules)
+
+    # update the best rules and cross validation of the affected participants, with the stored rows moved to the same dictionary
+    stored, rules = remap(os.path.join(data, 'BestRules' + experiment), rules)
+    BRule = updateBestRules(stored, mvData, rules, study, affected)
+    saveResults(os.path.join(data, 'BestRules' + experiment), BRule, rules, csv=True)
+
+    stored, rules = remap(os.path.join(data, 'CVResults' + experiment), rules)
+    CVResults = updateCrossValidation(stored, BRule, affected, k, seed)
+    saveResults(os.path.join(data, 'CVResults' + experiment), CVResults, rules, csv=True)
+
+def checkRefit(experiment, mode='enum', depth=4, data=DATA):
+    """
+    Refit a copy of the stored csv results of a study, as they are in the repository without any .npz files, after adding a participant
+    (a copy of the first) and changing a trial of the second. The best rules of the other participants must stay the same, and no row
+    may lose its posterior. Returns the participants whose best rule changed although they were not affected, which should be none.
+    """
+    study = loadStudy(experiment)
+    first, second = pd.unique(study['participant_id'])[:2]
+    added = study[study['participant_id'] == first].assign(participant_id=study['participant_id'].max() + 1)
+    study = pd.concat([study, added], ignore_index=True)
+    row = study.index[study['participant_id'] == second][0]
+    study.loc[row, 'prediction_raw'] = '1' if study.loc[row, 'prediction_raw'] == '0' else '0'
+
+    with tempfile.TemporaryDirectory() as tmp:
+        for name in ['LoT', 'BestRules', 'CVResults']:
+            shutil.copy(os.path.join(data, name + experiment + '.csv'), tmp)
+        before = pd.read_csv(os.path.join(tmp, 'BestRules' + experiment + '.csv')).drop_duplicates('p_id').set_index('p_id')['rule']
+        refit(experiment, mode, depth, ckpt=os.path.join(tmp, 'checkpoints'), data=tmp, study=study)
+        after = pd.read_csv(os.path.join(tmp, 'BestRules' + experiment + '.csv'))
+
+    assert not after['posterior'].isna().any(), "Rows without a posterior after the refit"
+    after = after.drop_duplicates('p_id').set_index('p_id')['rule']
+    kept = before.index.difference([second])
+    return list(kept[before[kept].to_numpy() != after[kept].to_numpy()])
+
+# only run this code if the program is run with this file as the main
+if __name__ == '__main__':
+
+    # get the study to update, and how the new and changed participants are fitted
+    parser = argparse.ArgumentParser(description='Update the stored results of a study after participants or trials were added.')
+    parser.add_argument('experiment')
+    parser.add_argument('--mode', default='mcmc', choices=MODES)
+    parser.add_argument('--depth', type=int, default=4)
+    parser.add_argument('--steps', type=int, default=50000, help='the steps of a warm started chain of a changed participant')
+    parser.add_argument('--ckpt', default=None, help='the checkpoint directory of the sampler, by default the one LoT.py writes to')
+    parser.add_argument('--workers', type=int, default=None)
+    parser.add_argument('--k', type=int, default=6)
+    parser.add_argument('--seed', type=int, default=7331)
+    parser.add_argument('--check', action='store_true', help='check a refit of a copy of the stored csv results instead of updating them')
+    args = parser.parse_args()
+
+    if args.check:
+        wrong = checkRefit(args.experiment, args.mode, args.depth)
+        print("Unaffected participants with a different best rule:", wrong)
+        raise SystemExit(1 if wrong else 0)
+
+    start = time.perf_counter()
+    refit(args.experiment, args.mode, args.depth, args.workers, args.ckpt, args.steps, args.k, args.seed)
+    print("Refit finished in", round(time.perf_counter() - start, 2), "s")
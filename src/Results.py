@@ -0,0 +1,147 @@
+import os
+import numpy as np
+import pandas as pd
+from Primitives import compileRule, ruleBody, seqCodes, SEQS, OUTPUTS, ZERO, ONE, FALSE, NONE
+
+# the columns that hold a single predicted bit, of the participant, the model average or the cross validation
+BIT_COLUMNS = ['p_pred', 'bma_pred', 'BayFold_pred', 'BayLOOCV_pred']
+
+# the codes of the outputs of a rule as they are written in a csv
+M_PRED_CODES = {'0' : ZERO, '1' : ONE, 'False' : FALSE, 'None' : NONE}
+
+def packTables(tables):
+    # pack truth tables into 64 byte bitmasks, the first 32 bytes hold the low bit of every output code and the last 32 bytes the high bit
+    tables = np.asarray(tables, dtype=np.uint8).reshape(-1, len(SEQS))
+    return np.hstack([np.packbits(tables & 1, axis=1), np.packbits(tables >> 1, axis=1)])
+
+def unpackTables(masks):
+    # turn the bitmasks back into truth tables with one output code per sequence
+    return (np.unpackbits(masks[:, :32], axis=1) + 2 * np.unpackbits(masks[:, 32:], axis=1)).astype(np.int8)
+
+def ruleTables(rules):
+    """
+    Get the truth tables of all rules in a rule dictionary, where row i is the table of rule_id i.
+    """
+    return unpackTables(np.frombuffer(b''.join(rules['mask']), dtype=np.uint8).reshape(-1, 64))
+
+def ruleDictionary(exprs, prior=None):
+    """
+    Create the dictionary of the given distinct rule expressions, with their id (their position), log prior and the bitmask of their
+    output on all 256 sequences.
+    """
+    masks = packTables([compileRule(expr) for expr in exprs]) if len(exprs) else np.zeros((0, 64), dtype=np.uint8)
+    return pd.DataFrame({'rule_id' : np.arange(len(exprs), dtype=np.uint32), 'rule' : list(exprs),
+                         'prior' : np.nan if prior is None else prior, 'mask' : [m.tobytes() for m in masks]})
+
+def normalize(results, rules=None):
+    """
+    Split a wide results dataframe, with a rule string and sequence on every row, into a fact table and a rule dictionary. In the fact
+    table rules and sequences are replaced by small integer ids (rule_id, and seq_id which is the binary value of the sequence), bits are
+    stored as uint8, the outputs of rules (m_pred) as their codes, and text columns as categoricals. The prior of a rule is moved into
+    the dictionary. If an existing dictionary (rules) is given, its rules keep their ids and new rules are added after them, so facts
+    that refer to the existing dictionary stay valid.
+    """
+    facts = {}
+    exprs = []
+    known = [] if rules is None else list(rules['rule'])
+
+    for col in results.columns:
+        values = results[col]
+        if col == 'rule':
+            bodies = values.map(ruleBody)
+            seen = set(known)
+            exprs = pd.Index(known + [e for e in pd.unique(bodies) if e not in seen])
+            facts['rule_id'] = exprs.get_indexer(bodies).astype(np.uint32)
+        elif col == 'prior':
+            continue
+        elif col == 'sequence':
+            facts['seq_id'] = seqCodes(values).astype(np.uint8)
+        elif col in BIT_COLUMNS:
+            facts[col] = (values.astype(str) == '1').to_numpy().astype(np.uint8)
+        elif col == 'm_pred':
+            facts[col] = values.map(lambda m: M_PRED_CODES.get(str(m), NONE)).to_numpy().astype(np.int8)
+        elif col == 'p_id':
+            facts[col] = values.to_numpy().astype(np.uint32)
+        elif pd.api.types.is_numeric_dtype(values) or pd.api.types.is_bool_dtype(values):
+            facts[col] = values.to_numpy()
+        else:
+            facts[col] = pd.Categorical(values)
+
+    # the prior of every rule, taken from its first row, or from the existing dictionary
+    prior = None
+    if 'prior' in results.columns and len(exprs):
+        prior = np.full(len(exprs), np.nan)
+        first = results['prior'].groupby(facts['rule_id']).first()
+        prior[first.index.to_numpy()] = first.to_numpy()
+        if rules is not None:
+            prior[:len(known)] = rules['prior'].to_numpy()
+
+    if rules is None:
+        return pd.DataFrame(facts), ruleDictionary(list(exprs), prior)
+
+    # the new rules are added after the rules of the existing dictionary
+    added = ruleDictionary(list(exprs[len(known):]), None if prior is None else prior[len(known):])
+    added['rule_id'] = (added['rule_id'] + len(known)).astype(np.uint32)
+    return pd.DataFrame(facts), pd.concat([rules, added], ignore_index=True)
+
+def denormalize(facts, rules, prior=False):
+    """
+    Turn a fact table back into the wide format, with the sequences and rules as strings and bits as '0' or '1', for instance to write a
+    csv for the R scripts. The prior of each rule is added after the rule if prior is True.
+    """
+    wide = {}
+    for col in facts.columns:
+        values = facts[col].to_numpy()
+        if col == 'seq_id':
+            wide['sequence'] = np.array(SEQS)[values]
+        elif col == 'rule_id':
+            wide['rule'] = rules['rule'].to_numpy()[values]
+            if prior:
+                wide['prior'] = rules['prior'].to_numpy()[values]
+        elif col in BIT_COLUMNS:
+            wide[col] = np.where(values == 1, '1', '0')
+        elif col == 'm_pred':
+            wide[col] = OUTPUTS[values]
+        else:
+            wide[col] = facts[col]
+    return pd.DataFrame(wide, index=facts.index)
+
+def saveResults(base, facts, rules, csv=False):
+    """
+    Save a fact table and its rule dictionary to base.npz, and optionally also the wide format to base.csv.
+    """
+    arrays = {'__columns__' : np.array(facts.columns, dtype=str)}
+    for col in facts.columns:
+        if isinstance(facts[col].dtype, pd.CategoricalDtype):
+            arrays['facts/' + col] = facts[col].cat.codes.to_numpy()
+            arrays['categories/' + col] = np.array(facts[col].cat.categories, dtype=str)
+        else:
+            arrays['facts/' + col] = facts[col].to_numpy()
+
+    arrays['rules/rule'] = np.array(rules['rule'], dtype=str)
+    arrays['rules/prior'] = rules['prior'].to_numpy(dtype=float)
+    arrays['rules/mask'] = np.frombuffer(b''.join(rules['mask']), dtype=np.uint8).reshape(-1, 64)
+
+    np.savez_compressed(base + '.npz', **arrays)
+    if csv:
+        denormalize(facts, rules).to_csv(base + '.csv', index=False)
+
+def loadResults(base):
+    """
+    Load a fact table and its rule dictionary from base.npz. If there is no such file, the wide csv base.csv is read and normalized,
+    so results written before the compact format can still be used.
+    """
+    if not os.path.exists(base + '.npz'):
+        return normalize(pd.read_csv(base + '.csv', dtype={'sequence' : str, 'm_pred' : str, **{col : str for col in BIT_COLUMNS}}))
+
+    with np.load(base + '.npz', allow_pickle=False) as f:
+        facts = {}
+        for col in f['__columns__']:
+            if 'categories/' + col in f:
+                facts[col] = pd.Categorical.from_codes(f['facts/' + col], f['categories/' + col])
+            else:
+                facts[col] = f['facts/' + col]
+        rules = pd.DataFrame({'rule_id' : np.arange(len(f['rules/rule']), dtype=np.uint32), 'rule' : f['rules/rule'],
+                              'prior' : f['rules/prior'], 'mask' : [m.tobytes() for m in f['rules/mask']]})
+
+    return pd.DataFrame(facts), rules
@@ -0,0 +1,173 @@
+import os
+import json
+import asyncio
+import argparse
+import numpy as np
+from Results import loadResults, ruleTables
+from Primitives import OUTPUTS, SEQS, ZERO, ONE
+
+# the folder with the stored results of every study
+DATA = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'Data')
+
+class PredictionTables:
+    """
+    The predictions of the best rule of every participant of a study on all 256 sequences, and the Bayesian model averaged prediction of
+    every generator on all 256 sequences. The model average is the same as in BayInf.bmaPredict, over the correct best rules of all rows
+    with the sequence and generator, but without leaving anyone out. Sequences that no participant saw with a generator are predicted by
+    the posterior weighted vote of the best rules of the participants of that generator.
+    """
+    def __init__(self, bestRules, rules):
+        owners = bestRules[['p_id', 'rule_id']].drop_duplicates('p_id')
+        self.index = {int(p) : i for i, p in enumerate(owners['p_id'])}
+        self.tables = ruleTables(rules)[owners['rule_id'].to_numpy()]
+
+        # the weight of every row, only rules that were correct on the row count
+        w = bestRules['posterior'].where(bestRules['correct'].astype(bool), 0).to_numpy()
+        wm = w * bestRules['m_pred'].to_numpy().astype(int)
+        seq = bestRules['seq_id'].to_numpy().astype(int)
+        generator = bestRules['generator'].astype(str).to_numpy()
+
+        # the posterior of the best rule of every participant, and the generator they saw, for the vote on unseen sequences
+        first = bestRules.drop_duplicates('p_id')
+        posterior = first['posterior'].to_numpy()
+        seen = first['generator'].astype(str).to_numpy()
+
+        self.bma = {}
+        for g in np.unique(generator):
+            rows = generator == g
+            W = np.bincount(seq[rows], weights=w[rows], minlength=256)
+            WM = np.bincount(seq[rows], weights=wm[rows], minlength=256)
+
+            # the vote of the rules of the participants of the generator, only counting rules that give a bit
+            t = self.tables[seen == g]
+            vote = posterior[seen == g] @ (t == ONE) / np.maximum(posterior[seen == g] @ ((t == ZERO) | (t == ONE)), 1e-300)
+
+            with np.errstate(divide='ignore', invalid='ignore'):
+                self.bma[g] = np.where(np.bincount(seq[rows], minlength=256) > 0, (W > 0) & (WM / W >= 0.5), vote >= 0.5).astype(np.uint8)
+
+    def predict(self, p, seqs):
+        # the outputs of the best rule of participant p on the sequences, None if the rule gives no answer
+        out = self.tables[self.index[int(p)], seqs]
+        return [OUTPUTS[o] if o in (ZERO, ONE) else None for o in out]
+
+    def average(self, generator, seqs):
+        # the model averaged predictions of the generator on the sequences
+        return np.where(self.bma[generator][seqs] == 1, '1', '0').tolist()
+
+def seqIds(sequences):
+    # the ids of the sequences, which can be given as 8 bit strings or as their binary value, anything else raises a ValueError
+    ids = []
+    for s in sequences:
+        if isinstance(s, str) and len(s) == len(SEQS[0]) and set(s) <= {'0', '1'}:
+            ids.append(int(s, 2))
+        elif isinstance(s, int) and not isinstance(s, bool) and 0 <= s < len(SEQS):
+            ids.append(s)
+        else:
+            raise ValueError('not a sequence of 8 bits or an id from 0 to 255: ' + repr(s))
+    return np.array(ids, dtype=np.int64)
+
+def respond(writer, status, response):
+    # write a json response with its status
+    payload = json.dumps(response).encode()
+    writer.write(('HTTP/1.1 ' + status + '\r\nContent-Type: application/json\r\nContent-Length: ' + str(len(payload)) +
+                  '\r\n\r\n').encode() + payload)
+
+def answer(studies, request):
+    """
+    Answer a request, which is a dictionary with the sequences and either a participant (p_id) or a generator, and the study if more than
+    one study is served. Returns the predictions, or an error.
+    """
+    if not isinstance(request, dict):
+        return {'error' : 'a request is a json object'}
+    try:
+        study = request.get('study', next(iter(studies)))
+        if study not in studies:
+            return {'error' : 'unknown study ' + str(study)}
+        tables = studies[study]
+        seqs = seqIds(request.get('sequences', []))
+        if 'p_id' in request:
+            return {'predictions' : tables.predict(request['p_id'], seqs)}
+        if 'generator' in request:
+            return {'predictions' : tables.average(request['generator'], seqs)}
+        return {'error' : 'a request needs a p_id or a generator'}
+    except KeyError as e:
+        return {'error' : 'unknown participant or generator ' + str(e)}
+    except (ValueError, IndexError, TypeError) as e:
+        return {'error' : 'invalid request: ' + str(e)}
+
+async def handle(reader, writer, studies):
+    """
+    Serve the requests of a single connection, which stays open for as many requests as the client sends. A request is a POST of a json
+    body to /predict, which is answered with json.
+    """
+    try:
+        while True:
+            head = await reader.readuntil(b'\r\n\r\n')
+            lines = head.decode('latin-1').split('\r\n')
+            request = lines[0].split(' ', 2)
+            headers = {k.strip().lower() : v.strip() for k, v in (l.split(':', 1) for l in lines[1:] if ':' in l)}
+
+            # without a valid length the body can not be read, so the connection is closed after the error
+            try:
+                length = int(headers.get('content-length', 0))
+                if length < 0:
+                    raise ValueError
+            except ValueError:
+                respond(writer, '400 Bad Request', {'error' : 'invalid Content-Length'})
+                await writer.drain()
+                break
+            body = await reader.readexactly(length)
+
+            # any request that can not be answered gets a 400, the connection stays open for the next request
+            try:
+                if len(request) < 3:
+                    raise ValueError('invalid request line')
+                method, path, _ = request
+                if method == 'POST' and path == '/predict':
+                    try:
+                        response = answer(studies, json.loads(body))
+                    except json.JSONDecodeError:
+                        response = {'error' : 'the body is not json'}
+                    status = '400 Bad Request' if 'error' in response else '200 OK'
+                elif method == 'GET' and path == '/health':
+                    response, status = {'studies' : list(studies)}, '200 OK'
+                else:
+                    response, status = {'error' : 'not found'}, '404 Not Found'
+            except Exception as e:
+                response, status = {'error' : 'invalid request: ' + str(e)}, '400 Bad Request'
+
+            respond(writer, status, response)
+            await writer.drain()
+            if headers.get('connection', '').lower() == 'close':
+                break
+    except (asyncio.IncompleteReadError, ConnectionResetError):
+        pass
+    finally:
+        writer.close()
+
+async def serve(studies, host='127.0.0.1', port=8787, socket=None):
+    # serve the predictions over tcp, or over a unix socket if a path is given
+    if socket:
+        server = await asyncio.start_unix_server(lambda r, w: handle(r, w, studies), path=socket)
+    else:
+        server = await asyncio.start_server(lambda r, w: handle(r, w, studies), host, port)
+    print("Serving", ', '.join(studies), "on", socket or host + ':' + str(port))
+    async with server:
+        await server.serve_forever()
+
+def loadTables(experiments, data=DATA):
+    # the prediction tables of every study, from its stored best rules
+    return {exp : PredictionTables(*loadResults(os.path.join(data, 'BestRules' + exp))) for exp in experiments}
+
+# only run this code if the program is run with this file as the main
+if __name__ == '__main__':
+
+    # get the studies to serve, and where to serve them
+    parser = argparse.ArgumentParser(description='Serve the predictions of the best rules and the model average of the studies.')
+    parser.add_argument('experiments', nargs='+')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8787)
+    parser.add_argument('--socket', default=None, help='serve on this unix socket instead of tcp')
+    args = parser.parse_args()
+
+    asyncio.run(serve(loadTables(args.experiments), args.host, args.port, args.socket))
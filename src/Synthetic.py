@@ -0,0 +1,173 @@
+import os
+import time
+import argparse
+import resource
+import multiprocessing
+from queue import Empty
+import numpy as np
+import pandas as pd
+from LoT import enumerateRules, fitStudy, MODES
+from Primitives import compileRule, SEQS, ZERO, ONE
+from LoadData import loadStudy, toColumns
+from Results import normalize
+from BestRule import selectBestRules
+from BayInf import crossValidate
+
+def drawRules(space, n, rng):
+    """
+    Draw n ground truth rules from the grammar, as positions in an enumerated rule space (see enumerateRules). Every rule is drawn with its
+    prior probability, so this follows the grammar restricted to the depth of the space, with every behaviour represented by its
+    simplest rule.
+    """
+    p = np.exp(space.prior - space.prior.max())
+    return rng.choice(len(space), size=n, p=p / p.sum())
+
+def simulateStudy(n, space, template, trials=None, alpha=0.999, seed=7331, study='S'):
+    """
+    Simulate the trials of n participants that each follow a rule drawn from the grammar, in the same format as the sheets of the workbook.
+    Every participant gets the trials (sequence, generator, rate and type) of a random participant of the template sheet, or the given
+    number of trials drawn from the distinct sequences of the template with the same generator. A participant answers with the output of their rule
+    with probability alpha and otherwise at random, the same as the noise of the likelihood, and always at random if their rule gives no
+    output. Returns the sheet and the ground truth, with the rule of every participant.
+    """
+    rng = np.random.default_rng(seed)
+    truth = drawRules(space, n, rng)
+
+    # the trials of a random template participant for every synthetic participant
+    groups = {p : g.index.to_numpy() for p, g in template.groupby('participant_id', sort=False)}
+    owners = rng.choice(list(groups), size=n)
+    if trials is None:
+        rows = np.concatenate([groups[o] for o in owners])
+    else:
+        # a participant never sees the same sequence twice, so the trials are drawn from the distinct sequences of the generator
+        generator = template['generator'].to_numpy()
+        distinct = template.drop_duplicates(['generator', 'sequence']).index.to_numpy()
+        byGenerator = {g : distinct[generator[distinct] == g] for g in np.unique(generator)}
+        picks = [byGenerator[generator[groups[o][0]]] for o in owners]
+        rows = np.concatenate([rng.choice(pick, size=min(trials, len(pick)), replace=False) for pick in picks])
+    lengths = [len(groups[o]) for o in owners] if trials is None else [min(trials, len(pick)) for pick in picks]
+
+    data = template.iloc[rows, :].reset_index(drop=True)
+    data['study'] = study
+    data['participant_id'] = np.repeat(np.arange(1, n + 1), lengths)
+    data['trial'] = np.concatenate([np.arange(1, l + 1) for l in lengths])
+
+    # look up the output of the rule of every participant, and add the noise
+    seq = np.array([int(x, 2) for x in data['sequence']])
+    out = space.tables[np.repeat(truth, lengths), seq]
+    guess = rng.integers(0, 2, len(data))
+    follow = (rng.random(len(data)) < alpha) & ((out == ZERO) | (out == ONE))
+    pred = np.where(follow, out, guess)
+
+    data['prediction_raw'] = np.where(pred == 1, '1', '0')
+    data['prediction_recode'] = (data['prediction_raw'] == data['sequence'].str[-1]).astype(int)
+
+    truth = pd.DataFrame({'p_id' : np.arange(1, n + 1), 'rule' : [space.rules[i] for i in truth], 'prior' : space.prior[truth]})
+    return data, truth
+
+def writeStudy(data, path):
+    """
+    Write a simulated sheet as an excel workbook with a single sheet, if it fits in the rows of a sheet, and otherwise in the columnar format
+    of the cache of LoadData.
+    """
+    if path.endswith('.xlsx') and len(data) < 1048576:
+        data.to_excel(path, sheet_name='Study ' + str(data['study'].iloc[0]), index=False)
+    else:
+        np.savez(os.path.splitext(path)[0] + '.npz', **toColumns(data))
+
+def recovery(LoTData, truth, data):
+    """
+    Compare the best rule found for every participant to the rule they followed. A rule is recovered when it behaves the same on all 256
+    sequences, and recovered on the seen sequences when it behaves the same on the sequences the participant saw, which is the best the
+    data allows. The agreement is the fraction of the 256 sequences on which both rules give the same output.
+    """
+    best = LoTData.sort_values('posterior', ascending=False, kind='stable').drop_duplicates('p_id').set_index('p_id')
+    found = np.array([compileRule(r) for r in best.loc[truth['p_id'], 'rule']])
+    true = np.array([compileRule(r) for r in truth['rule']])
+
+    # the sequences seen by every participant
+    seen = np.zeros((len(truth), len(SEQS)), dtype=bool)
+    row = pd.Index(truth['p_id']).get_indexer(data['participant_id'])
+    seen[row, [int(x, 2) for x in data['sequence']]] = True
+
+    same = found == true
+    return {'recovered' : float(same.all(axis=1).mean()), 'recovered_seen' : float((same | ~seen).all(axis=1).mean()),
+            'agreement' : float(same.mean())}
+
+def peakMemory():
+    # the peak resident memory of this process in MB, which linux reports in kB
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+def scaleRun(n, args, queue):
+    """
+    Simulate n participants and run the fitting pipeline on them (the LoT model, best rule selection and k-fold cross validation), timing
+    every stage. This runs in its own process, so the peak memory belongs to this size alone. The report is put on the queue, with the
+    stage that failed if the pipeline fell over.
+    """
+    report = {'participants' : n, 'mode' : args.mode, 'depth' : args.depth, 'trials' : args.trials, 'alpha' : args.alpha}
+    try:
+        start = time.perf_counter()
+        space = enumerateRules(args.depth)
+        template = loadStudy(args.template)
+        data, truth = simulateStudy(n, space, template, args.trials, args.alpha, args.seed)
+        report['simulate_sec'] = time.perf_counter() - start
+        report['rows'] = len(data)
+        if args.output:
+            writeStudy(data, os.path.join(args.output, 'Synthetic' + str(n) + '.xlsx'))
+            truth.to_csv(os.path.join(args.output, 'Synthetic' + str(n) + '_truth.csv'), index=False)
+
+        report['stage'] = 'fit'
+        start = time.perf_counter()
+        LoTData = fitStudy(data, args.mode, args.depth, args.workers)
+        report['fit_sec'] = time.perf_counter() - start
+        report.update(recovery(LoTData, truth, data))
+
+        report['stage'] = 'best'
+        start = time.perf_counter()
+        bestRules = selectBestRules(*normalize(LoTData), data)
+        report['best_sec'] = time.perf_counter() - start
+
+        report['stage'] = 'cv'
+        start = time.perf_counter()
+        crossValidate(bestRules, repeats=0)
+        report['cv_sec'] = time.perf_counter() - start
+        report['stage'] = 'done'
+
+    except MemoryError:
+        report['failed'] = 'out of memory'
+    report['peak_mb'] = peakMemory()
+    queue.put(report)
+
+# only run this code if the program is run with this file as the main
+if __name__ == '__main__':
+
+    # run the pipeline on simulated studies of increasing size, every size in a fresh process
+    parser = argparse.ArgumentParser(description='Simulate participants that follow rules of the grammar, and measure how the fitting scales.')
+    parser.add_argument('--sizes', type=int, nargs='+', default=[1000, 10000, 100000])
+    parser.add_argument('--mode', default='enum', choices=MODES)
+    parser.add_argument('--depth', type=int, default=4)
+    parser.add_argument('--trials', type=int, default=None, help='the number of trials per participant, by default those of the template')
+    parser.add_argument('--alpha', type=float, default=0.999)
+    parser.add_argument('--seed', type=int, default=7331)
+    parser.add_argument('--template', default='1B', help='the study whose trials are used for the simulated participants')
+    parser.add_argument('--workers', type=int, default=None)
+    parser.add_argument('--output', default=None, help='write the simulated sheets and their ground truth to this folder')
+    parser.add_argument('--report', default='../Data/ScalingReport.csv')
+    args = parser.parse_args()
+
+    reports = []
+    for n in args.sizes:
+        queue = multiprocessing.Queue()
+        worker = multiprocessing.Process(target=scaleRun, args=(n, args, queue))
+        worker.start()
+        worker.join()
+
+        # a process that was killed, e.g. by the out of memory killer, does not report back
+        try:
+            report = queue.get(timeout=5)
+        except Empty:
+            report = {'participants' : n, 'failed' : 'exit code ' + str(worker.exitcode)}
+        print(report)
+        reports.append(report)
+
+    pd.DataFrame(reports).to_csv(args.report, index=False)
@@ -14,6 +14,7 @@ module load Python/3.12.3-GCCcore-13.3.0
 # Activate the virtual environment
 source ~/lotlib3-env/bin/activate
 
-# run scripts
-python LoT.py 1B
-python LoT.py 2B
+# run scripts, finished participants and chain checkpoints are stored so a resubmitted job continues where it stopped
+# the metrics of the samplers are written as json lines, the progress of the job can be followed with: python Monitor.py LoT1B_metrics.jsonl --participants 300
+python LoT.py 1B --metrics LoT1B_metrics.jsonl
+python LoT.py 2B --metrics LoT2B_metrics.jsonl